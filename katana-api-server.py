@@ -4,15 +4,42 @@ API Server para integração do katana-custom com ICMS
 Hospedado em instância AWS EC2
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel
 import subprocess
+import gzip
+import hashlib
+import heapq
+import io
 import json
 import os
+import re
 import asyncio
-from datetime import datetime
+import bisect
+import contextvars
+import fcntl
+import signal
+import socket
+import sqlite3
+import time
+import urllib.request
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from collections import Counter, deque
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from urllib.parse import urlparse
+from xml.etree import ElementTree
 import logging
 
+from tutorial.records import is_record_file, page_columns, read_records
+from tutorial.stats import keyword_counts, percentile
+from tutorial.urls import url_rank
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,12 +55,850 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Comprimir respostas grandes (insights com exemplos de concorrentes)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Configurações
-KATANA_BINARY = "/app/katana"
-SCRAPY_SCRIPT = "/app/scrapy-runner.py"
-DATA_DIR = "/app/data"
-CONFIG_DIR = "/app/config"
+# Caminhos podem ser trocados por variáveis de ambiente (ex.: loadtest/ com katana stub)
+APP_DIR = os.environ.get("KATANA_APP_DIR", "/app")  # Raiz com scrapy.cfg, onde o scrapy é executado
+KATANA_BINARY = os.environ.get("KATANA_BINARY", f"{APP_DIR}/katana")
+SCRAPY_SCRIPT = os.environ.get("SCRAPY_SCRIPT", f"{APP_DIR}/scrapy-runner.py")
+DATA_DIR = os.environ.get("KATANA_DATA_DIR", f"{APP_DIR}/data")
+CONFIG_DIR = os.environ.get("KATANA_CONFIG_DIR", f"{APP_DIR}/config")
+API_PORT = int(os.environ.get("KATANA_API_PORT", "3001"))
 CACHE_EXPIRY_HOURS = 6  # Cache válido por 6 horas
+URL_BUDGET = 30  # Limite de URLs analisadas por categoria
+SCRAPY_SHARDS = 1  # Processos do scrapy-runner (--shards), particionados por host
+MAX_PAGE_BYTES = 2 * 1024 * 1024  # Downloads maiores são abortados pelo scrapy-runner
+MAX_PAGE_BYTES_BY_CATEGORY: dict[str, int] = {}  # Exceções por categoria (ex.: lojas com páginas pesadas)
+# Parar o scrapy quando as métricas da categoria estabilizarem (--converge). Desligado:
+# as URLs chegam ordenadas por host e rank, não como amostra aleatória, e o intervalo
+# de confiança fecharia cedo sobre os primeiros hosts agendados
+SCRAPY_CONVERGE = False
+SEO_OUTPUT_FORMAT = "bin"  # Saída do scrapy-runner: "bin" (tutorial.records, leitura preguiçosa) ou "json"
+KATANA_LINE_LIMIT = 8 * 1024 * 1024  # Tamanho máximo de uma linha JSONL do katana
+RENDER_HISTORY_FILE = f"{DATA_DIR}/render_history.json"
+RENDER_MIN_ENDPOINTS = 5  # Abaixo disso o crawl padrão é complementado com headless
+RENDER_HEADLESS_GAIN = 1.5  # Headless precisa achar 50% mais endpoints para ser mantido
+RENDER_HISTORY_DAYS = 14  # Hosts são reavaliados após esse período
+SITEMAP_STAGE_SECONDS = 30  # Tempo máximo da descoberta por sitemap antes do katana
+SITEMAP_TIMEOUT_SECONDS = 10  # Timeout de cada requisição de robots.txt/sitemap
+SITEMAP_MIN_URLS = 3  # Abaixo disso o sitemap não é utilizável e o seed vai para o katana
+SITEMAP_KEEP_PER_SEED = 100  # URLs mais recentes (lastmod) mantidas por seed
+SITEMAP_MAX_ENTRIES = 50000  # Entradas lidas por seed, somando todos os sitemaps
+SITEMAP_MAX_FETCHES = 10  # Sitemaps (e sub-sitemaps de índices) baixados por seed
+SITEMAP_WORKERS = 8  # Threads dedicadas aos downloads de sitemap (fora do executor padrão)
+SITEMAP_USER_AGENT = "ICMS SEO Analyzer/1.0 (+https://fluxo.software)"
+LEASE_DB = f"{DATA_DIR}/leases.db"  # Deve ficar no armazenamento compartilhado entre instâncias
+LEASE_TTL_SECONDS = 120  # Lease expira se o worker parar de renovar (crash)
+LEASE_HEARTBEAT_SECONDS = 30
+LEASE_WAIT_SECONDS = 900  # Tempo máximo esperando o refresh de outro worker
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+SNAPSHOT_DB = f"{DATA_DIR}/snapshots.db"  # Histórico de insights por categoria (último dado bom)
+SNAPSHOT_KEYFRAME_INTERVAL = 10  # Versões entre snapshots completos; as demais são deltas
+SNAPSHOT_RETENTION = 100  # Versões mantidas por categoria
+SNAPSHOT_RETENTION_DAYS = 90  # Versões mais antigas são removidas (a mais recente sempre fica)
+REFRESH_FAILURE_BACKOFF_SECONDS = 1800  # Após um refresh sem páginas, não repetir o crawl automaticamente
+BATCH_REFRESH_CONCURRENCY = 2  # Crawls simultâneos disparados pelo endpoint em lote
+CATEGORY_PATTERN = re.compile(r"[a-z0-9][a-z0-9-]*")
+ADMISSION_MAX_RSS_MB = 3072  # Memória total reservada para katana/scrapy em execução
+ADMISSION_MIN_AVAILABLE_MB = 512  # MemAvailable mínimo que deve sobrar após admitir
+ADMISSION_MAX_CPU_PERCENT = 100 * (os.cpu_count() or 1)  # CPU somada das execuções (100% = 1 núcleo)
+ADMISSION_MAX_LOAD_PER_CPU = 2.0
+ADMISSION_ESTIMATES = {"headless": 700, "standard": 120, "scrapy": 150}  # MB por execução até haver medição
+ADMISSION_POLL_SECONDS = 1.0
+ADMISSION_MAX_WAIT_SECONDS = 600
+CRAWL_BUDGET_SECONDS = 600  # Prazo total de um refresh (katana + scrapy)
+KATANA_BUDGET_SHARE = 0.6  # Fração do prazo reservada à descoberta de URLs pelo katana
+KILL_GRACE_SECONDS = 10  # Entre SIGTERM e SIGKILL no grupo de processos (o scrapy grava o parcial)
+DISCONNECT_POLL_SECONDS = 1.0
+ADMISSION_DECISION_LOG = 100  # Decisões recentes expostas em /api/admission
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+class RefreshLeases:
+    """Leases de refresh por categoria em SQLite, compartilhados entre workers
+    
+    Cada lease tem um dono (token) e uma expiração renovada por heartbeat;
+    se o dono morrer, o lease expira e outro worker pode assumir.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "name TEXT PRIMARY KEY, holder TEXT NOT NULL, "
+            "acquired_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        return conn
+    
+    def acquire(self, name: str, holder: str, ttl: float) -> bool:
+        conn = self._connect()
+        try:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                conn.execute("ROLLBACK")
+                return False
+            if row and row[0] != holder:
+                logger.warning(f"Lease for {name} held by {row[0]} expired, taking over")
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, holder, acquired_at, expires_at) VALUES (?, ?, ?, ?)",
+                (name, holder, now, now + ttl)
+            )
+            conn.execute("COMMIT")
+            return True
+        finally:
+            conn.close()
+    
+    def renew(self, name: str, holder: str, ttl: float) -> bool:
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE name = ? AND holder = ?",
+                (time.time() + ttl, name, holder)
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+    
+    def release(self, name: str, holder: str):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+        finally:
+            conn.close()
+    
+    def holder(self, name: str) -> str | None:
+        """Dono atual do lease, se não expirado"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT holder FROM leases WHERE name = ? AND expires_at > ?", (name, time.time())
+            ).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+refresh_leases = RefreshLeases(LEASE_DB)
+
+class SnapshotStore:
+    """Versões dos insights calculados por categoria em SQLite
+    
+    A cada SNAPSHOT_KEYFRAME_INTERVAL versões é gravado um snapshot completo
+    (zlib); as demais são comprimidas usando o último completo como dicionário
+    (zdict), o que reduz cada versão aos trechos que mudaram. Também registra
+    a última falha de refresh, usada para não repetir crawls que não coletam nada.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "category TEXT NOT NULL, version INTEGER NOT NULL, created_at REAL NOT NULL, "
+            "base_version INTEGER, hash TEXT NOT NULL, pages INTEGER NOT NULL, data BLOB NOT NULL, "
+            "PRIMARY KEY (category, version))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS refresh_failures ("
+            "category TEXT PRIMARY KEY, failed_at REAL NOT NULL, reason TEXT NOT NULL)"
+        )
+        return conn
+    
+    @staticmethod
+    def _encode(insights: dict) -> bytes:
+        return json.dumps(insights, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    
+    @staticmethod
+    def _content_hash(insights: dict) -> str:
+        # analysisDate muda a cada crawl; o hash identifica só o conteúdo
+        content = {key: value for key, value in insights.items() if key != "analysisDate"}
+        return hashlib.sha256(SnapshotStore._encode(content)).hexdigest()[:32]
+    
+    @staticmethod
+    def _compress(raw: bytes, zdict: bytes | None) -> bytes:
+        if zdict is None:
+            return zlib.compress(raw, 9)
+        compressor = zlib.compressobj(9, zdict=zdict)
+        return compressor.compress(raw) + compressor.flush()
+    
+    @staticmethod
+    def _decompress(data: bytes, zdict: bytes | None) -> bytes:
+        if zdict is None:
+            return zlib.decompress(data)
+        decompressor = zlib.decompressobj(zdict=zdict)
+        return decompressor.decompress(data) + decompressor.flush()
+    
+    def _load(self, conn, category: str, version: int) -> dict | None:
+        row = conn.execute(
+            "SELECT base_version, data FROM snapshots WHERE category = ? AND version = ?", (category, version)
+        ).fetchone()
+        if row is None:
+            return None
+        base_version, data = row
+        zdict = None
+        if base_version is not None:
+            (base_data,) = conn.execute(
+                "SELECT data FROM snapshots WHERE category = ? AND version = ?", (category, base_version)
+            ).fetchone()
+            zdict = self._decompress(base_data, None)
+        return json.loads(self._decompress(data, zdict))
+    
+    def save(self, category: str, insights: dict) -> int | None:
+        """Gravar uma nova versão; retorna None se o conteúdo não mudou"""
+        content_hash = self._content_hash(insights)
+        raw = self._encode(insights)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            latest = conn.execute(
+                "SELECT version, hash, base_version FROM snapshots WHERE category = ? "
+                "ORDER BY version DESC LIMIT 1", (category,)
+            ).fetchone()
+            if latest and latest[1] == content_hash:
+                conn.execute("ROLLBACK")
+                return None
+            version = latest[0] + 1 if latest else 1
+            base_version = None
+            if latest:
+                keyframe = latest[2] if latest[2] is not None else latest[0]
+                if version - keyframe < SNAPSHOT_KEYFRAME_INTERVAL:
+                    base_version = keyframe
+            zdict = None
+            if base_version is not None:
+                (base_data,) = conn.execute(
+                    "SELECT data FROM snapshots WHERE category = ? AND version = ?", (category, base_version)
+                ).fetchone()
+                zdict = self._decompress(base_data, None)
+            conn.execute(
+                "INSERT INTO snapshots (category, version, created_at, base_version, hash, pages, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (category, version, time.time(), base_version, content_hash,
+                 int(insights.get("pagesAnalyzed") or 0), self._compress(raw, zdict))
+            )
+            self._prune(conn, category, version)
+            conn.execute("COMMIT")
+            return version
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+    
+    def _prune(self, conn, category: str, latest_version: int):
+        """Aplicar a retenção; deltas cujo snapshot completo sai viram completos"""
+        cutoff = time.time() - SNAPSHOT_RETENTION_DAYS * 86400
+        expired = {
+            version for (version,) in conn.execute(
+                "SELECT version FROM snapshots WHERE category = ? AND version < ? AND (version <= ? OR created_at < ?)",
+                (category, latest_version, latest_version - SNAPSHOT_RETENTION, cutoff)
+            )
+        }
+        if not expired:
+            return
+        orphans = [
+            version for version, base_version in conn.execute(
+                "SELECT version, base_version FROM snapshots WHERE category = ? AND base_version IS NOT NULL "
+                "ORDER BY version", (category,)
+            ) if version not in expired and base_version in expired
+        ]
+        # O primeiro órfão vira o novo completo e os demais passam a usá-lo como base
+        rewritten = {version: self._load(conn, category, version) for version in orphans}
+        new_keyframe = None
+        for version in orphans:
+            raw = self._encode(rewritten[version])
+            zdict = self._encode(rewritten[new_keyframe]) if new_keyframe is not None else None
+            conn.execute(
+                "UPDATE snapshots SET base_version = ?, data = ? WHERE category = ? AND version = ?",
+                (new_keyframe, self._compress(raw, zdict), category, version)
+            )
+            if new_keyframe is None:
+                new_keyframe = version
+        conn.executemany(
+            "DELETE FROM snapshots WHERE category = ? AND version = ?",
+            [(category, version) for version in expired]
+        )
+    
+    def latest(self, category: str) -> dict | None:
+        """Versão mais recente: {"version", "createdAt", "insights"}"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT version, created_at FROM snapshots WHERE category = ? ORDER BY version DESC LIMIT 1",
+                (category,)
+            ).fetchone()
+            if row is None:
+                return None
+            return {
+                "version": row[0],
+                "createdAt": datetime.fromtimestamp(row[1]).isoformat(),
+                "insights": self._load(conn, category, row[0])
+            }
+        finally:
+            conn.close()
+    
+    def get(self, category: str, version: int) -> dict | None:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT created_at FROM snapshots WHERE category = ? AND version = ?", (category, version)
+            ).fetchone()
+            if row is None:
+                return None
+            return {
+                "version": version,
+                "createdAt": datetime.fromtimestamp(row[0]).isoformat(),
+                "insights": self._load(conn, category, version)
+            }
+        finally:
+            conn.close()
+    
+    def history(self, category: str, limit: int = 20) -> list:
+        """Metadados das versões mais recentes, sem descomprimir os dados"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT version, created_at, base_version, hash, pages, length(data) FROM snapshots "
+                "WHERE category = ? ORDER BY version DESC LIMIT ?", (category, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {
+                "version": version,
+                "createdAt": datetime.fromtimestamp(created_at).isoformat(),
+                "kind": "key" if base_version is None else "delta",
+                "hash": content_hash,
+                "pagesAnalyzed": pages,
+                "storedBytes": stored_bytes
+            }
+            for version, created_at, base_version, content_hash, pages, stored_bytes in rows
+        ]
+    
+    def record_failure(self, category: str, reason: str):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO refresh_failures (category, failed_at, reason) VALUES (?, ?, ?)",
+                (category, time.time(), reason)
+            )
+        finally:
+            conn.close()
+    
+    def clear_failure(self, category: str):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM refresh_failures WHERE category = ?", (category,))
+        finally:
+            conn.close()
+    
+    def recent_failure(self, category: str, within: float) -> dict | None:
+        """Última falha de refresh da categoria, se ocorreu há menos de `within` segundos"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT failed_at, reason FROM refresh_failures WHERE category = ? AND failed_at > ?",
+                (category, time.time() - within)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {"failedAt": datetime.fromtimestamp(row[0]).isoformat(), "reason": row[1]}
+
+snapshots = SnapshotStore(SNAPSHOT_DB)
+
+def diff_insights(old: dict, new: dict) -> dict:
+    """Diferenças entre duas versões de insights, por chave (a.b.c)
+    
+    Listas de valores simples (commonKeywords) são comparadas como conjuntos;
+    as demais listas são comparadas inteiras.
+    """
+    changed, added, removed = {}, {}, {}
+    
+    def flatten(value, prefix, out):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                flatten(item, f"{prefix}.{key}" if prefix else key, out)
+        else:
+            out[prefix] = value
+        return out
+    
+    old_flat = flatten(old, "", {})
+    new_flat = flatten(new, "", {})
+    for key in old_flat.keys() | new_flat.keys():
+        if key not in new_flat:
+            removed[key] = old_flat[key]
+        elif key not in old_flat:
+            added[key] = new_flat[key]
+        elif old_flat[key] != new_flat[key]:
+            before, after = old_flat[key], new_flat[key]
+            scalar_lists = all(
+                isinstance(v, list) and not any(isinstance(i, (dict, list)) for i in v) for v in (before, after)
+            )
+            if scalar_lists:
+                changed[key] = {
+                    "added": [item for item in after if item not in before],
+                    "removed": [item for item in before if item not in after]
+                }
+            elif isinstance(before, (int, float)) and isinstance(after, (int, float)):
+                changed[key] = {"from": before, "to": after, "delta": round(after - before, 4)}
+            else:
+                changed[key] = {"from": before, "to": after}
+    return {
+        "changed": dict(sorted(changed.items())),
+        "added": dict(sorted(added.items())),
+        "removed": dict(sorted(removed.items()))
+    }
+
+# Lease de refresh do task atual (categoria, token); tasks criados dentro dele herdam
+current_lease = contextvars.ContextVar("current_lease", default=None)
+
+@asynccontextmanager
+async def refresh_lease(category: str):
+    """Tentar obter o lease de refresh da categoria; produz True se obtido
+    
+    Se o heartbeat não conseguir renovar (o lease expirou e outro worker
+    assumiu), o task dono é cancelado e o bloco termina com exceção.
+    """
+    token = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+    acquired = await asyncio.to_thread(refresh_leases.acquire, category, token, LEASE_TTL_SECONDS)
+    if not acquired:
+        yield False
+        return
+    
+    owner = asyncio.current_task()
+    lost = False
+    
+    async def heartbeat():
+        nonlocal lost
+        while True:
+            await asyncio.sleep(LEASE_HEARTBEAT_SECONDS)
+            try:
+                renewed = await asyncio.to_thread(refresh_leases.renew, category, token, LEASE_TTL_SECONDS)
+            except sqlite3.Error as e:
+                # O lease continua válido até expirar; tentar de novo no próximo ciclo
+                logger.warning(f"Could not renew refresh lease for {category}: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Lost refresh lease for {category}, cancelling the refresh")
+                lost = True
+                owner.cancel()
+                return
+    
+    heartbeat_task = asyncio.create_task(heartbeat())
+    lease_context = current_lease.set((category, token))
+    try:
+        yield True
+    except asyncio.CancelledError:
+        if not lost:
+            raise
+        owner.uncancel()
+        raise Exception(f"Lost refresh lease for {category}") from None
+    finally:
+        current_lease.reset(lease_context)
+        heartbeat_task.cancel()
+        await asyncio.to_thread(refresh_leases.release, category, token)
+
+async def lease_still_held(category: str) -> bool:
+    """Renovar o lease do task atual antes de gravar dados da categoria"""
+    lease = current_lease.get()
+    if lease is None or lease[0] != category:
+        return True
+    return await asyncio.to_thread(refresh_leases.renew, category, lease[1], LEASE_TTL_SECONDS)
+
+async def wait_for_refresh(category: str):
+    """Esperar o worker dono do lease terminar o refresh da categoria"""
+    deadline = time.monotonic() + LEASE_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        if not await asyncio.to_thread(refresh_leases.holder, category):
+            return
+        await asyncio.sleep(2)
+    logger.warning(f"Timed out waiting for refresh of {category}")
+
+class Deadline:
+    """Prazo absoluto (relógio monotônico) de um refresh ou de uma etapa dele"""
+    
+    def __init__(self, seconds: float):
+        self.at = time.monotonic() + seconds
+    
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.monotonic())
+    
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+    
+    def stage(self, share: float) -> "Deadline":
+        """Sub-prazo com uma fração do tempo restante"""
+        return Deadline(self.remaining() * share)
+
+def signal_process_group(process, sig: int):
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def terminate_process_group(process, grace: float = KILL_GRACE_SECONDS):
+    """SIGTERM no grupo do processo (filhos do Chromium inclusos) e SIGKILL após `grace`"""
+    if process.returncode is not None:
+        return
+    signal_process_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(asyncio.shield(process.wait()), grace)
+    except asyncio.TimeoutError:
+        if grace > 0:
+            logger.warning(f"Process {process.pid} ignored SIGTERM, killing its group")
+    # Mata também filhos que sobreviveram ao líder do grupo
+    signal_process_group(process, signal.SIGKILL)
+    await process.wait()
+
+async def cancel_on_disconnect(request: Request, coro):
+    """Executar `coro`, cancelando-o (e seus subprocessos) se o cliente desconectar"""
+    task = asyncio.create_task(coro)
+    while True:
+        try:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+        except asyncio.CancelledError:
+            # Cancelado por fora (ex.: lease perdido): o crawl não pode continuar sozinho
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            raise
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            logger.info("Client disconnected, cancelling crawl")
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            raise Exception("Client disconnected before the crawl finished")
+
+def proc_tree_usage(root_pid: int) -> tuple:
+    """RSS (bytes) e ticks de CPU acumulados de um processo e descendentes (/proc)"""
+    children = {}
+    stats = {}
+    try:
+        pids = [int(name) for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return 0, 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                raw = f.read()
+        except OSError:
+            continue
+        # O nome do processo (campo 2) pode conter espaços; os campos seguem o último ")"
+        fields = raw[raw.rfind(b")") + 2:].split()
+        ppid = int(fields[1])
+        stats[pid] = (int(fields[11]) + int(fields[12]), int(fields[21]) * PAGE_SIZE)
+        children.setdefault(ppid, []).append(pid)
+    rss = ticks = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        if pid in stats:
+            ticks += stats[pid][0]
+            rss += stats[pid][1]
+        pending.extend(children.get(pid, ()))
+    return rss, ticks
+
+def mem_available_bytes() -> int | None:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class AdmissionRun:
+    """Execução admitida: estimativa de memória e uso medido dos processos"""
+    
+    def __init__(self, category: str, kind: str, estimate: int):
+        self.id = uuid.uuid4().hex[:8]
+        self.category = category
+        self.kind = kind
+        self.estimate = estimate
+        self.pids = []
+        self.rss = 0
+        self.cpu_percent = 0.0
+        self.ticks = None
+        self.started = time.monotonic()
+    
+    def track(self, pid: int):
+        self.pids.append(pid)
+    
+    @property
+    def reserved(self) -> int:
+        """Memória considerada ocupada: o maior entre o medido e o estimado"""
+        return max(self.rss, self.estimate)
+
+class AdmissionController:
+    """Controle de admissão das execuções do katana por memória e CPU
+    
+    Cada execução reserva ADMISSION_ESTIMATES[kind] (ou o RSS medido, se
+    maior) contra ADMISSION_MAX_RSS_MB; também é preciso haver MemAvailable e
+    load average abaixo dos limites. As que não cabem esperam numa fila por
+    categoria, atendida primeiro para quem tem menos execuções em andamento
+    (em rodízio no empate) e sem ultrapassagem, para que uma rajada
+    de uma categoria não atrase as demais e um headless grande não fique
+    para trás indefinidamente. O scrapy é só monitorado (`wait=False`): ele
+    depende do katana da mesma categoria e não pode bloqueá-lo.
+    """
+    
+    def __init__(self):
+        self.running = {}
+        self.waiting = {}  # categoria -> deque de (future, run), em ordem de rodízio
+        self.decisions = deque(maxlen=ADMISSION_DECISION_LOG)
+        self.counters = Counter()
+        self.monitor_task = None
+        self.sampled_at = time.monotonic()
+    
+    def _decide(self, run: AdmissionRun, decision: str, reason: str):
+        self.counters[decision] += 1
+        self.decisions.append({
+            "at": datetime.now().isoformat(),
+            "category": run.category,
+            "kind": run.kind,
+            "decision": decision,
+            "reason": reason
+        })
+        logger.info(f"Admission {decision} for {run.category} ({run.kind}): {reason}")
+    
+    def headroom(self, run: AdmissionRun) -> str | None:
+        """None se a execução cabe agora; senão o motivo da espera"""
+        if not self.running:
+            return None  # Sempre admitir uma execução, para a fila nunca travar
+        reserved = sum(other.reserved for other in self.running.values())
+        if reserved + run.estimate > ADMISSION_MAX_RSS_MB * 1024 * 1024:
+            return f"rss {reserved // 2**20}MB + {run.estimate // 2**20}MB > {ADMISSION_MAX_RSS_MB}MB"
+        available = mem_available_bytes()
+        if available is not None and available - run.estimate < ADMISSION_MIN_AVAILABLE_MB * 1024 * 1024:
+            return f"MemAvailable {available // 2**20}MB"
+        cpu = sum(other.cpu_percent for other in self.running.values())
+        if cpu > ADMISSION_MAX_CPU_PERCENT:
+            return f"cpu {cpu:.0f}% > {ADMISSION_MAX_CPU_PERCENT}%"
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        if load > ADMISSION_MAX_LOAD_PER_CPU:
+            return f"load {load:.2f}/cpu"
+        return None
+    
+    def _admit_waiting(self):
+        while self.waiting:
+            # Categoria com menos execuções em andamento; empate resolvido pelo rodízio
+            active = Counter(run.category for run in self.running.values())
+            category = min(self.waiting, key=lambda name: active[name])
+            queue = self.waiting[category]
+            future, run = queue[0]
+            if future.done():  # Cancelado pelo chamador
+                queue.popleft()
+            elif self.headroom(run) is not None:
+                return
+            else:
+                queue.popleft()
+                self.running[run.id] = run
+                self._decide(run, "admitted", f"waited {time.monotonic() - run.started:.1f}s")
+                run.started = time.monotonic()
+                future.set_result(None)
+            # Rodízio: a categoria vai para o fim da fila
+            del self.waiting[category]
+            if queue:
+                self.waiting[category] = queue
+    
+    def sample(self, runs: list):
+        """Atualizar RSS e CPU medidos das execuções (lista copiada no event loop)"""
+        now = time.monotonic()
+        elapsed = max(now - self.sampled_at, 1e-3)
+        self.sampled_at = now
+        for run, pids in runs:
+            rss = ticks = 0
+            for pid in pids:
+                pid_rss, pid_ticks = proc_tree_usage(pid)
+                rss += pid_rss
+                ticks += pid_ticks
+            if run.ticks is not None:
+                run.cpu_percent = 100 * (ticks - run.ticks) / CLOCK_TICKS / elapsed
+            run.rss, run.ticks = rss, ticks
+    
+    async def monitor(self):
+        try:
+            while self.running or self.waiting:
+                try:
+                    # slot() altera self.running no event loop enquanto a thread amostra
+                    runs = [(run, list(run.pids)) for run in self.running.values()]
+                    await asyncio.to_thread(self.sample, runs)
+                    self._admit_waiting()
+                except Exception as e:
+                    logger.error(f"Admission monitor iteration failed: {e}")
+                await asyncio.sleep(ADMISSION_POLL_SECONDS)
+        finally:
+            self.monitor_task = None
+    
+    @asynccontextmanager
+    async def slot(self, category: str, kind: str, wait: bool = True, timeout: float | None = None):
+        """Aguardar admissão; produz a execução, onde o chamador registra os pids"""
+        run = AdmissionRun(category, kind, ADMISSION_ESTIMATES.get(kind, 0) * 1024 * 1024)
+        reason = self.headroom(run) if wait else None
+        if reason is None and not (wait and self.waiting):
+            self.running[run.id] = run
+            self._decide(run, "admitted", "tracked" if not wait else "headroom")
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.waiting.setdefault(category, deque()).append((future, run))
+            self._decide(run, "queued", reason or "behind queued runs")
+            if self.monitor_task is None:
+                self.monitor_task = asyncio.create_task(self.monitor())
+            max_wait = ADMISSION_MAX_WAIT_SECONDS if timeout is None else min(timeout, ADMISSION_MAX_WAIT_SECONDS)
+            try:
+                await asyncio.wait_for(future, max_wait)
+            except asyncio.TimeoutError:
+                self._decide(run, "rejected", f"not admitted after {max_wait:.0f}s")
+                raise Exception(f"Admission timeout for {category} ({kind})")
+        if self.monitor_task is None:
+            self.monitor_task = asyncio.create_task(self.monitor())
+        try:
+            yield run
+        finally:
+            self.running.pop(run.id, None)
+            self._admit_waiting()
+    
+    def status(self) -> dict:
+        available = mem_available_bytes()
+        return {
+            "limits": {
+                "max_rss_mb": ADMISSION_MAX_RSS_MB,
+                "min_available_mb": ADMISSION_MIN_AVAILABLE_MB,
+                "max_cpu_percent": ADMISSION_MAX_CPU_PERCENT,
+                "max_load_per_cpu": ADMISSION_MAX_LOAD_PER_CPU,
+                "estimates_mb": ADMISSION_ESTIMATES
+            },
+            "system": {
+                "mem_available_mb": available // 2**20 if available is not None else None,
+                "loadavg": os.getloadavg(),
+                "cpus": os.cpu_count()
+            },
+            "running": [
+                {
+                    "category": run.category,
+                    "kind": run.kind,
+                    "pids": run.pids,
+                    "rss_mb": run.rss // 2**20,
+                    "reserved_mb": run.reserved // 2**20,
+                    "cpu_percent": round(run.cpu_percent, 1),
+                    "seconds": round(time.monotonic() - run.started, 1)
+                }
+                for run in self.running.values()
+            ],
+            "queued": {category: len(queue) for category, queue in self.waiting.items()},
+            "counters": dict(self.counters),
+            "decisions": list(self.decisions)
+        }
+
+admission = AdmissionController()
+
+def write_json_atomic(path: str, data: dict):
+    """Gravar JSON via arquivo temporário + rename para leitores nunca verem escrita parcial"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def seo_output_file(category: str) -> str:
+    """Saída do scrapy da categoria: o formato configurado, ou o outro se só ele existir"""
+    formats = [SEO_OUTPUT_FORMAT] + [fmt for fmt in ("bin", "json") if fmt != SEO_OUTPUT_FORMAT]
+    for fmt in formats:
+        path = f"{DATA_DIR}/{category}_seo.{fmt}"
+        if os.path.exists(path):
+            return path
+    return f"{DATA_DIR}/{category}_seo.{SEO_OUTPUT_FORMAT}"
+
+def staging_output_file(category: str) -> str:
+    """Saída de um crawl em andamento, ainda não promovida a dado atual"""
+    return f"{DATA_DIR}/{category}_seo.staging.{SEO_OUTPUT_FORMAT}"
+
+def data_generation(category: str) -> dict | None:
+    """Identificar a geração atual dos dados da categoria (base do ETag)"""
+    cache_file = f"{DATA_DIR}/{category}_cache.json"
+    seo_file = seo_output_file(category)
+    try:
+        stat = os.stat(seo_file)
+        with open(cache_file, "r") as f:
+            last_updated = json.load(f)["last_updated"]
+        age_seconds = (datetime.now() - datetime.fromisoformat(last_updated)).total_seconds()
+    except (OSError, ValueError, KeyError):
+        return None
+    
+    key = f"{category}|{last_updated}|{stat.st_mtime_ns}|{stat.st_size}"
+    return {
+        "etag": '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"',
+        "last_updated": last_updated,
+        "age_seconds": age_seconds
+    }
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Comparação fraca do If-None-Match, como pede a RFC 9110 (``etag`` sem o W/)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def insights_cache_headers(generation: dict) -> dict:
+    """ETag e Cache-Control a partir da idade dos dados e de CACHE_EXPIRY_HOURS
+    
+    O ETag é fraco: o GZipMiddleware serve a mesma geração com gzip ou sem
+    codificação, e a RFC 9110 não permite um ETag forte igual para corpos
+    com bytes diferentes.
+    """
+    expiry_seconds = int(CACHE_EXPIRY_HOURS * 3600)
+    max_age = max(0, int(expiry_seconds - generation["age_seconds"]))
+    last_modified = datetime.fromisoformat(generation["last_updated"]).astimezone(timezone.utc)
+    return {
+        "ETag": f"W/{generation['etag']}",
+        "Cache-Control": f"public, max-age={max_age}, stale-while-revalidate={expiry_seconds}",
+        "Last-Modified": format_datetime(last_modified, usegmt=True)
+    }
+
+# Últimos insights calculados por categoria: {category: (etag, insights, body)}
+insights_bodies = {}
+
+def current_insights(category: str, generation: dict) -> tuple:
+    """Insights e corpo serializado da geração atual, calculados uma vez por geração"""
+    cached = insights_bodies.get(category)
+    if cached and cached[0] == generation["etag"]:
+        return cached[1], cached[2]
+    seo_data = read_seo_output(seo_output_file(category))
+    insights = process_category_insights(seo_data, category)
+    body = json_body(insights)
+    insights_bodies[category] = (generation["etag"], insights, body)
+    return insights, body
+
+def cache_age_hours(category: str) -> float | None:
+    """Idade (em horas) dos dados da categoria, ou None se não houver cache válido"""
+    cache_file = f"{DATA_DIR}/{category}_cache.json"
+    seo_file = seo_output_file(category)
+    if not (os.path.exists(cache_file) and os.path.exists(seo_file)):
+        return None
+    try:
+        with open(cache_file, "r") as f:
+            cache_data = json.load(f)
+        last_update = datetime.fromisoformat(cache_data["last_updated"])
+        return (datetime.now() - last_update).total_seconds() / 3600
+    except Exception as cache_error:
+        logger.warning(f"Cache validation failed: {cache_error}")
+        return None
 
 @app.get("/")
 async def root():
@@ -57,27 +922,39 @@ async def health_check():
         logger.error(f"Health check failed: {e}")
         raise HTTPException(status_code=503, detail="Service unhealthy")
 
+@app.get("/api/admission")
+async def admission_status():
+    """Estado do controle de admissão: execuções, filas e decisões recentes"""
+    return admission.status()
+
 @app.post("/api/refresh/{category}")
-async def refresh_category_data(category: str):
+async def refresh_category_data(category: str, request: Request):
     """Força refresh dos dados de uma categoria"""
     try:
         logger.info(f"Manual refresh requested for category: {category}")
         
-        # Executar análise completa
-        urls = await run_katana_analysis(category)
-        seo_data = await run_scrapy_analysis(urls, category)
-        
-        # Salvar timestamp do cache
-        cache_file = f"{DATA_DIR}/{category}_cache.json"
-        cache_data = {
-            "category": category,
-            "last_updated": datetime.now().isoformat(),
-            "urls_count": len(urls),
-            "pages_analyzed": len(seo_data.get("pages", []))
-        }
+        # Executar análise completa (apenas um worker por categoria)
+        async with refresh_lease(category) as acquired:
+            if not acquired:
+                return {
+                    "status": "in_progress",
+                    "category": category,
+                    "holder": refresh_leases.holder(category),
+                    "timestamp": datetime.now().isoformat()
+                }
+            # Cliente desconectou: cancelar o crawl, como no analyze_category
+            urls, seo_data, collected = await cancel_on_disconnect(request, run_category_crawl(category))
         
-        with open(cache_file, "w") as f:
-            json.dump(cache_data, f)
+        if not collected:
+            # GET continua servindo o último dado bom; o refresh reporta a falha
+            return Response(json_body({
+                "status": "no_pages",
+                "category": category,
+                "urls_collected": len(urls),
+                "pages_analyzed": 0,
+                "served_data": await asyncio.to_thread(served_data_info, category),
+                "timestamp": datetime.now().isoformat()
+            }), status_code=502, media_type="application/json")
         
         return {
             "status": "success",
@@ -91,84 +968,688 @@ async def refresh_category_data(category: str):
         logger.error(f"Error refreshing category {category}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def served_data_info(category: str) -> dict | None:
+    """Origem e idade do dado que o GET serve enquanto o refresh falha"""
+    generation = data_generation(category)
+    if generation is not None:
+        return {
+            "source": "current",
+            "last_updated": generation["last_updated"],
+            "age_seconds": round(generation["age_seconds"])
+        }
+    versions = snapshots.history(category, 1)
+    if versions:
+        created_at = versions[0]["createdAt"]
+        return {
+            "source": "snapshot",
+            "version": versions[0]["version"],
+            "last_updated": created_at,
+            "age_seconds": round((datetime.now() - datetime.fromisoformat(created_at)).total_seconds())
+        }
+    return None
+
+@app.get("/api/category-insights/{category}")
+async def get_category_insights_cached(category: str, request: Request, background_tasks: BackgroundTasks):
+    """
+    Versão GET dos insights, com ETag/304 e Cache-Control para o ICMS e CDNs
+    """
+    generation = data_generation(category)
+    if generation is None:
+        # Sem dados ainda - primeira análise segue o fluxo do POST
+        _insights, body, generation = await analyze_category(category, request, background_tasks)
+        if generation is None:
+            return insights_response(body, None)
+    elif generation["age_seconds"] >= CACHE_EXPIRY_HOURS * 3600:
+        # Servir a geração atual e atualizar em background
+        background_tasks.add_task(refresh_category_background, category)
+    
+    headers = insights_cache_headers(generation)
+    if etag_matches(request.headers.get("if-none-match"), generation["etag"]):
+        return Response(status_code=304, headers=headers)
+    
+    _insights, body = await asyncio.to_thread(current_insights, category, generation)
+    return Response(body, media_type="application/json", headers=headers)
+
+def validate_category(category: str):
+    if not CATEGORY_PATTERN.fullmatch(category):
+        raise HTTPException(status_code=400, detail=f"Invalid category: {category}")
+
+@app.get("/api/category-insights/{category}/history")
+async def get_insights_history(category: str, limit: int = 20):
+    """Versões guardadas dos insights da categoria (só metadados)"""
+    validate_category(category)
+    versions = await asyncio.to_thread(snapshots.history, category, max(1, min(limit, SNAPSHOT_RETENTION)))
+    return {"category": category, "versions": versions}
+
+@app.get("/api/category-insights/{category}/history/{version}")
+async def get_insights_version(category: str, version: int):
+    """Insights de uma versão específica do histórico"""
+    validate_category(category)
+    snapshot = await asyncio.to_thread(snapshots.get, category, version)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"Snapshot {version} not found for {category}")
+    return snapshot
+
+@app.get("/api/category-insights/{category}/diff")
+async def get_insights_diff(category: str, from_version: int | None = Query(None, alias="from"),
+                            to_version: int | None = Query(None, alias="to")):
+    """Diferenças entre duas versões (padrão: a penúltima e a mais recente)"""
+    validate_category(category)
+    if to_version is None:
+        latest = await asyncio.to_thread(snapshots.history, category, 1)
+        if not latest:
+            raise HTTPException(status_code=404, detail=f"No snapshots for {category}")
+        to_version = latest[0]["version"]
+    if from_version is None:
+        from_version = to_version - 1
+    
+    old, new = await asyncio.gather(
+        asyncio.to_thread(snapshots.get, category, from_version),
+        asyncio.to_thread(snapshots.get, category, to_version)
+    )
+    missing = [str(v) for v, snapshot in ((from_version, old), (to_version, new)) if snapshot is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Snapshot {', '.join(missing)} not found for {category}")
+    return {
+        "category": category,
+        "from": {"version": old["version"], "createdAt": old["createdAt"]},
+        "to": {"version": new["version"], "createdAt": new["createdAt"]},
+        **diff_insights(old["insights"], new["insights"])
+    }
+
+def json_body(data: dict) -> bytes:
+    """Serializar como o JSONResponse do Starlette"""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+class BatchInsightsRequest(BaseModel):
+    categories: list[str] | None = None  # Padrão: todas as categorias em CONFIG_DIR
+
+@app.post("/api/category-insights")
+async def get_batch_category_insights(payload: BatchInsightsRequest):
+    """
+    Insights de várias categorias em uma única chamada (dashboard do ICMS)
+    
+    Categorias em cache são resolvidas em paralelo; as que não têm dados
+    recebem na hora o último snapshot (status "stale") ou os valores padrão
+    (status "fallback"), e o crawl roda em background com no máximo
+    BATCH_REFRESH_CONCURRENCY simultâneos, sem prender a resposta. O campo
+    "refreshing" indica se há um refresh agendado ou em andamento.
+    """
+    started = time.monotonic()
+    categories = payload.categories
+    if categories is None:
+        categories = sorted(
+            name[:-4] for name in os.listdir(CONFIG_DIR) if name.endswith(".txt")
+        ) if os.path.isdir(CONFIG_DIR) else []
+    categories = list(dict.fromkeys(categories))
+    invalid = [c for c in categories if not CATEGORY_PATTERN.fullmatch(c)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid categories: {', '.join(invalid)}")
+    
+    async def resolve(category: str) -> dict:
+        try:
+            generation = await asyncio.to_thread(data_generation, category)
+            if generation is None:
+                # Sem dados: snapshot ou fallback agora, crawl em background (salvo falha recente)
+                insights = await asyncio.to_thread(get_fallback_insights, category)
+                failure = await asyncio.to_thread(
+                    snapshots.recent_failure, category, REFRESH_FAILURE_BACKOFF_SECONDS
+                )
+                refreshing = failure is None and schedule_batch_refresh(category)
+                status = "stale" if insights.get("stale") else "fallback"
+                return {"status": status, "refreshing": refreshing, "ageHours": None, "insights": insights}
+            
+            insights, _body = await asyncio.to_thread(current_insights, category, generation)
+            age_hours = round(generation["age_seconds"] / 3600, 2)
+            if age_hours >= CACHE_EXPIRY_HOURS:
+                status = "stale"
+                refreshing = schedule_batch_refresh(category)
+            else:
+                status = "fresh"
+                refreshing = category in batch_refresh_tasks or category in inflight_refreshes
+            return {"status": status, "refreshing": refreshing, "ageHours": age_hours, "insights": insights}
+        except Exception as e:
+            logger.error(f"Batch insights failed for {category}: {e}")
+            return {"status": "error", "error": str(e)}
+    
+    results = await asyncio.gather(*(resolve(category) for category in categories))
+    return {
+        "categories": dict(zip(categories, results)),
+        "elapsedMs": int((time.monotonic() - started) * 1000),
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Refreshes em andamento neste worker, para não repetir o crawl da mesma categoria
+inflight_refreshes = {}
+batch_refresh_slots = asyncio.Semaphore(BATCH_REFRESH_CONCURRENCY)
+
+# Refreshes agendados pelo endpoint em lote (referências mantidas até terminarem)
+batch_refresh_tasks = {}
+
+def schedule_batch_refresh(category: str) -> bool:
+    """Agendar o refresh da categoria em background, limitado por batch_refresh_slots
+    
+    Retorna True, inclusive quando já havia um refresh agendado ou em andamento.
+    """
+    if category in batch_refresh_tasks or category in inflight_refreshes:
+        return True
+    
+    async def bounded_refresh():
+        async with batch_refresh_slots:
+            await coalesced_refresh(category)
+    
+    task = asyncio.create_task(bounded_refresh())
+    batch_refresh_tasks[category] = task
+    task.add_done_callback(lambda _task: batch_refresh_tasks.pop(category, None))
+    return True
+
+async def coalesced_refresh(category: str):
+    """Executar (ou aguardar) o refresh em andamento da categoria neste worker"""
+    task = inflight_refreshes.get(category)
+    if task is None:
+        task = asyncio.create_task(refresh_category_background(category))
+        inflight_refreshes[category] = task
+        task.add_done_callback(lambda _task: inflight_refreshes.pop(category, None))
+    await asyncio.shield(task)
+
+def insights_response(body: bytes, generation: dict | None) -> Response:
+    """Resposta com os cabeçalhos de cache da geração, ou no-cache para snapshot e fallback"""
+    headers = insights_cache_headers(generation) if generation else {"Cache-Control": "no-cache"}
+    return Response(body, media_type="application/json", headers=headers)
+
 @app.post("/api/category-insights/{category}")
-async def get_category_insights(category: str, background_tasks: BackgroundTasks):
+async def get_category_insights(category: str, request: Request, background_tasks: BackgroundTasks):
     """
     Endpoint principal para análise de categoria
     Usado pelo ICMS Content Optimizer
     """
+    _insights, body, generation = await analyze_category(category, request, background_tasks)
+    return insights_response(body, generation)
+
+async def analyze_category(category: str, request: Request, background_tasks: BackgroundTasks) -> tuple:
+    """Insights da categoria: (insights, corpo serializado, geração dos dados)
+    
+    A geração é None quando a resposta vem de um snapshot ou do fallback.
+    """
     try:
         logger.info(f"Analyzing category: {category}")
         
         # Verificar cache existente
-        cache_file = f"{DATA_DIR}/{category}_cache.json"
-        seo_file = f"{DATA_DIR}/{category}_seo.json"
+        seo_file = seo_output_file(category)
         
         # Verificar se cache é válido (menos de 6 horas)
         use_cache = False
-        if os.path.exists(cache_file) and os.path.exists(seo_file):
-            try:
-                with open(cache_file, "r") as f:
-                    cache_data = json.load(f)
-                
-                last_update = datetime.fromisoformat(cache_data["last_updated"])
-                hours_diff = (datetime.now() - last_update).total_seconds() / 3600
-                
-                if hours_diff < CACHE_EXPIRY_HOURS:
-                    use_cache = True
-                    logger.info(f"Using cached data for {category} (updated {hours_diff:.1f}h ago)")
-            except Exception as cache_error:
-                logger.warning(f"Cache validation failed: {cache_error}")
+        hours_diff = cache_age_hours(category)
+        if hours_diff is not None and hours_diff < CACHE_EXPIRY_HOURS:
+            use_cache = True
+            logger.info(f"Using cached data for {category} (updated {hours_diff:.1f}h ago)")
         
-        if use_cache:
-            # Usar dados em cache
-            try:
-                with open(seo_file, "r") as f:
-                    seo_data = json.load(f)
-            except Exception as read_error:
-                logger.error(f"Error reading cached data: {read_error}")
-                seo_data = {"pages": []}
-        else:
-            # Executar análise completa em background se cache expirou
-            if os.path.exists(seo_file):
+        if use_cache or os.path.exists(seo_file):
+            if not use_cache:
                 # Usar dados existentes enquanto atualiza em background
-                try:
-                    with open(seo_file, "r") as f:
-                        seo_data = json.load(f)
-                    
-                    # Agendar refresh em background
+                background_tasks.add_task(refresh_category_background, category)
+                logger.info(f"Serving cached data and refreshing {category} in background")
+            # Mesmo corpo (e ETag) do GET, calculado uma vez por geração
+            generation = data_generation(category)
+            if generation is not None:
+                insights, body = await asyncio.to_thread(current_insights, category, generation)
+                return insights, body, generation
+            seo_data = await asyncio.to_thread(read_seo_output, seo_file)
+        else:
+            # Sem dados atuais: servir o último snapshot, ou não repetir um crawl que acabou de falhar
+            snapshot = await asyncio.to_thread(snapshots.latest, category)
+            failure = await asyncio.to_thread(
+                snapshots.recent_failure, category, REFRESH_FAILURE_BACKOFF_SECONDS
+            )
+            if snapshot is not None:
+                if failure is None:
                     background_tasks.add_task(refresh_category_background, category)
-                    logger.info(f"Serving cached data and refreshing {category} in background")
-                except Exception:
-                    seo_data = {"pages": []}
-            else:
-                # Primeira vez - executar análise completa
-                logger.info(f"First time analysis for {category}")
-                urls = await run_katana_analysis(category)
-                seo_data = await run_scrapy_analysis(urls, category)
-                
-                # Salvar cache
-                cache_data = {
-                    "category": category,
-                    "last_updated": datetime.now().isoformat(),
-                    "urls_count": len(urls),
-                    "pages_analyzed": len(seo_data.get("pages", []))
-                }
-                
-                with open(cache_file, "w") as f:
-                    json.dump(cache_data, f)
+                logger.info(f"Serving snapshot {snapshot['version']} for {category}")
+                insights = snapshot_insights(snapshot)
+                return insights, json_body(insights), None
+            if failure is not None:
+                logger.info(f"Last refresh of {category} failed at {failure['failedAt']}, serving fallback")
+                insights = await asyncio.to_thread(get_fallback_insights, category)
+                return insights, json_body(insights), None
+            
+            # Primeira vez - executar análise completa, ou esperar o worker que já está executando
+            logger.info(f"First time analysis for {category}")
+            async with refresh_lease(category) as acquired:
+                if acquired:
+                    urls, seo_data, _collected = await cancel_on_disconnect(request, run_category_crawl(category))
+            if not acquired:
+                logger.info(f"Waiting for another worker to analyze {category}")
+                await wait_for_refresh(category)
+                seo_data = await asyncio.to_thread(read_seo_output, seo_output_file(category))
         
-        # Processar e retornar insights
-        insights = process_category_insights(seo_data, category)
+        # Processar e retornar insights (fora do event loop: dezenas de milhares de páginas)
+        generation = data_generation(category)
+        insights = await asyncio.to_thread(process_category_insights, seo_data, category)
+        body = json_body(insights)
+        if generation is not None and seo_data.get("pages"):
+            insights_bodies[category] = (generation["etag"], insights, body)
+        else:
+            generation = None
         
-        return insights
+        return insights, body, generation
         
     except Exception as e:
         logger.error(f"Error analyzing category {category}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def run_katana_analysis(category: str) -> list:
-    """Executar katana usando lista curada de URLs da categoria"""
+async def run_category_crawl(category: str, deadline: Deadline | None = None) -> tuple:
+    """Executar katana e scrapy em pipeline e salvar metadados do cache
+    
+    Retorna (urls, seo_data, coletou). A saída só substitui os dados atuais
+    se o crawl coletou páginas; do contrário a falha é registrada, os dados
+    anteriores são mantidos e voltam como seo_data com coletou=False.
+    """
+    staging_file = staging_output_file(category)
+    try:
+        urls, seo_data, timings = await run_crawl_pipeline(category, deadline)
+    except BaseException as e:
+        if os.path.exists(staging_file):
+            os.remove(staging_file)
+        if isinstance(e, Exception):
+            await asyncio.to_thread(snapshots.record_failure, category, str(e) or type(e).__name__)
+        raise
+    
+    # Outro worker pode ter assumido o lease: não gravar saída, snapshot nem falha
+    if not await lease_still_held(category):
+        if os.path.exists(staging_file):
+            os.remove(staging_file)
+        raise Exception(f"Lost refresh lease for {category}, discarding crawl output")
+    
+    if not seo_data.get("pages"):
+        reason = "no URLs discovered" if not urls else "no pages collected"
+        logger.warning(f"Crawl of {category} failed ({reason}), keeping previous data")
+        await asyncio.to_thread(snapshots.record_failure, category, reason)
+        if os.path.exists(staging_file):
+            os.remove(staging_file)
+        previous_file = seo_output_file(category)
+        if not os.path.exists(previous_file):
+            return urls, {"pages": []}, False
+        return urls, await asyncio.to_thread(read_seo_output, previous_file), False
+    
+    os.replace(staging_file, f"{DATA_DIR}/{category}_seo.{SEO_OUTPUT_FORMAT}")
+    cache_file = f"{DATA_DIR}/{category}_cache.json"
+    cache_data = {
+        "category": category,
+        "last_updated": datetime.now().isoformat(),
+        "urls_count": len(urls),
+        "pages_analyzed": len(seo_data.get("pages", [])),
+        "pipeline": timings
+    }
+    
+    write_json_atomic(cache_file, cache_data)
+    await asyncio.to_thread(save_snapshot, category, seo_data)
+    
+    return urls, seo_data, True
+
+def save_snapshot(category: str, seo_data: dict):
+    """Guardar os insights do crawl concluído no histórico da categoria"""
+    try:
+        version = snapshots.save(category, process_category_insights(seo_data, category))
+        snapshots.clear_failure(category)
+    except Exception as e:
+        logger.error(f"Could not save insights snapshot for {category}: {e}")
+        return
+    if version is not None:
+        logger.info(f"Saved insights snapshot {version} for {category}")
+
+def extract_katana_url(line: str) -> str:
+    """Extrair URL de uma linha JSONL (formato Katana ou {"url": ...})"""
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError:
+        return ""
+    if not isinstance(item, dict):
+        return ""
+    request = item.get("request")
+    if isinstance(request, dict) and request.get("endpoint"):
+        return request["endpoint"]
+    return item.get("url", "")
+
+async def drain_stream(stream, limit: int = 65536, label: str | None = None) -> bytes:
+    """Consumir um pipe até o fim mantendo apenas os últimos `limit` bytes
+    
+    Com `label`, cada linha também vai para o log (debug) conforme chega.
+    """
+    tail = b""
+    while True:
+        chunk = await stream.readline() if label else await stream.read(4096)
+        if not chunk:
+            return tail
+        if label:
+            logger.debug(f"[{label}] {chunk.decode(errors='replace').rstrip()}")
+        tail = (tail + chunk)[-limit:]
+
+class UrlBudget:
+    """Orçamento de URLs compartilhado entre as execuções do katana de uma categoria
+    
+    Cada host recebe no máximo `limit / hosts` URLs enquanto o katana roda, e
+    assets nunca entram direto; o excedente fica adiado e só completa o
+    orçamento no fim (`fill`), em rodízio entre hosts e páginas rasas primeiro.
+    Páginas adiadas por cota contam para esgotar o orçamento: com aceitas mais
+    adiadas suficientes o katana já pode parar.
+    """
+    
+    def __init__(self, limit: int, hosts: int = 0):
+        self.limit = limit
+        self.quota = -(-limit // hosts) if hosts else limit
+        self.urls = []
+        self.seen = set()
+        self.per_host = Counter()  # Endpoints descobertos por host (histórico de renderização)
+        self.accepted = Counter()
+        self.deferred = []
+        self.deferred_pages = 0  # Adiadas por cota (assets não contam)
+        self.exhausted = asyncio.Event()
+    
+    def add(self, url: str, line: str = "") -> bool:
+        """Registrar URL; retorna False se repetida, adiada ou se o orçamento acabou"""
+        if url in self.seen or self.exhausted.is_set():
+            return False
+        self.seen.add(url)
+        host = render_host(url)
+        self.per_host[host] += 1
+        if url_rank(url)[0] == 3:
+            self.deferred.append((url, line))
+            return False
+        if self.accepted[host] >= self.quota:
+            self.deferred.append((url, line))
+            self.deferred_pages += 1
+            self._check_exhausted()
+            return False
+        self._accept(url, host)
+        return True
+    
+    def _accept(self, url: str, host: str):
+        self.urls.append(url)
+        self.accepted[host] += 1
+        self._check_exhausted()
+    
+    def _check_exhausted(self):
+        if len(self.urls) + self.deferred_pages >= self.limit:
+            self.exhausted.set()
+    
+    def fill(self) -> list:
+        """Completar o orçamento com as URLs adiadas; retorna [(url, linha)]"""
+        taken = Counter(self.accepted)
+        ranked = []
+        for url, line in self.deferred:
+            host = render_host(url)
+            tier, depth = url_rank(url)
+            ranked.append(((tier, taken[host], depth), url, line, host))
+            taken[host] += 1
+        chosen = []
+        for _key, url, line, host in sorted(ranked, key=lambda entry: entry[0]):
+            if len(self.urls) >= self.limit:
+                break
+            self._accept(url, host)
+            chosen.append((url, line))
+        self.deferred = []
+        self.deferred_pages = 0
+        return chosen
+
+def render_host(url: str) -> str:
+    """Host usado no histórico de renderização (sem www.)"""
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+def _open_url(url: str):
+    request = urllib.request.Request(url, headers={"User-Agent": SITEMAP_USER_AGENT, "Accept-Encoding": "gzip"})
+    return urllib.request.urlopen(request, timeout=SITEMAP_TIMEOUT_SECONDS)
+
+def robots_sitemaps(seed: str) -> list:
+    """Sitemaps declarados no robots.txt do seed"""
+    parsed = urlparse(seed)
+    try:
+        with _open_url(f"{parsed.scheme}://{parsed.netloc}/robots.txt") as response:
+            body = response.read(512 * 1024).decode(errors="replace")
+    except (OSError, ValueError):
+        return []
+    return [
+        line.split(":", 1)[1].strip()
+        for line in body.splitlines()
+        if line.lower().startswith("sitemap:") and line.split(":", 1)[1].strip()
+    ]
+
+def iter_sitemap(url: str):
+    """Percorrer um sitemap (ou índice) em streaming: produz (tipo, loc, lastmod)
+    
+    `tipo` é "sitemap" para entradas de índice e "url" para páginas. Cada
+    elemento é descartado após lido, então a memória não cresce com o arquivo;
+    sitemaps .gz (ou servidos com gzip) são descompactados em streaming.
+    """
+    with _open_url(url) as response:
+        stream = io.BufferedReader(response)
+        if stream.peek(2)[:2] == b"\x1f\x8b":
+            stream = gzip.GzipFile(fileobj=stream)
+        context = ElementTree.iterparse(stream, events=("start", "end"))
+        _event, root = next(context)
+        for event, element in context:
+            if event != "end":
+                continue
+            tag = element.tag.rsplit("}", 1)[-1]
+            if tag not in ("url", "sitemap"):
+                continue
+            loc = lastmod = ""
+            for child in element:
+                name = child.tag.rsplit("}", 1)[-1]
+                if name == "loc":
+                    loc = (child.text or "").strip()
+                elif name == "lastmod":
+                    lastmod = (child.text or "").strip()
+            root.clear()
+            if loc:
+                yield tag, loc, lastmod
+
+def is_root_seed(seed: str) -> bool:
+    """Seed na raiz do site; seeds profundos (portais, buscas) vão direto para o katana"""
+    parsed = urlparse(seed)
+    return parsed.path in ("", "/") and not parsed.query
+
+def discover_sitemap_urls(seed: str, stop_at: float) -> list:
+    """URLs do site do seed via sitemap, as mais recentes (lastmod) primeiro
+    
+    Tenta os sitemaps do robots.txt, depois /sitemap.xml, /wp-sitemap.xml e
+    /sitemap_index.xml. Mantém só as SITEMAP_KEEP_PER_SEED entradas com
+    lastmod mais recente (heap), lendo no máximo SITEMAP_MAX_ENTRIES.
+    Retorna [(url, lastmod)], vazio se nenhum sitemap utilizável.
+    """
+    parsed = urlparse(seed)
+    host = render_host(seed)
+    base = f"{parsed.scheme}://{parsed.netloc}"
+    prefix = parsed.path.rstrip("/") + "/"
+    pending = robots_sitemaps(seed) + [f"{base}/sitemap.xml", f"{base}/wp-sitemap.xml", f"{base}/sitemap_index.xml"]
+    visited = set()
+    kept = []  # heap de (lastmod, url): a raiz é a menos recente
+    entries = 0
+    while pending and len(visited) < SITEMAP_MAX_FETCHES and time.monotonic() < stop_at:
+        sitemap_url = pending.pop(0)
+        if sitemap_url in visited:
+            continue
+        visited.add(sitemap_url)
+        children = []
+        try:
+            for kind, loc, lastmod in iter_sitemap(sitemap_url):
+                if kind == "sitemap":
+                    children.append((lastmod, loc))
+                    continue
+                entries += 1
+                # Só páginas sob o caminho do seed (seeds profundos em portais grandes)
+                if render_host(loc) == host and (urlparse(loc).path or "/").startswith(prefix):
+                    item = (lastmod, loc)
+                    if len(kept) < SITEMAP_KEEP_PER_SEED:
+                        heapq.heappush(kept, item)
+                    elif item > kept[0]:
+                        heapq.heapreplace(kept, item)
+                if entries >= SITEMAP_MAX_ENTRIES or time.monotonic() >= stop_at:
+                    break
+        except (OSError, ValueError, ElementTree.ParseError, EOFError) as e:
+            logger.debug(f"Sitemap {sitemap_url} unusable: {e}")
+            continue
+        # Índices: sub-sitemaps mais recentes primeiro, antes dos candidatos restantes
+        pending[:0] = [loc for _lastmod, loc in sorted(children, reverse=True)]
+        if len(kept) >= SITEMAP_MIN_URLS and not children:
+            break
+    if len(kept) < SITEMAP_MIN_URLS:
+        return []
+    return [(url, lastmod) for lastmod, url in sorted(kept, reverse=True)]
+
+# Downloads de sitemap bloqueiam por até SITEMAP_TIMEOUT_SECONDS cada; num pool
+# próprio eles não ocupam o executor padrão usado pelos asyncio.to_thread do servidor
+sitemap_executor = ThreadPoolExecutor(max_workers=SITEMAP_WORKERS, thread_name_prefix="sitemap")
+
+async def discover_sitemaps(seeds: list, deadline: Deadline | None) -> dict:
+    """Descoberta por sitemap de todas as seeds em paralelo: {seed: [(url, lastmod)]}"""
+    budget_seconds = SITEMAP_STAGE_SECONDS if deadline is None else min(SITEMAP_STAGE_SECONDS, deadline.remaining())
+    stop_at = time.monotonic() + budget_seconds
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *(loop.run_in_executor(sitemap_executor, discover_sitemap_urls, seed, stop_at) for seed in seeds),
+        return_exceptions=True
+    )
+    found = {}
+    for seed, result in zip(seeds, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Sitemap discovery failed for {seed}: {result}")
+        elif result:
+            found[seed] = result
+    return found
+
+def load_render_history() -> dict:
+    """Ler histórico por host de endpoints encontrados em cada modo"""
+    try:
+        with open(RENDER_HISTORY_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_render_history(updates: dict):
+    """Mesclar as entradas atualizadas no histórico e gravar de forma atômica
+    
+    O arquivo é relido sob um lock exclusivo (flock, compartilhado entre
+    workers), para que categorias concorrentes não percam atualizações.
+    """
+    if not updates:
+        return
+    os.makedirs(os.path.dirname(RENDER_HISTORY_FILE), exist_ok=True)
+    with open(f"{RENDER_HISTORY_FILE}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        history = load_render_history()
+        history.update(updates)
+        write_json_atomic(RENDER_HISTORY_FILE, history)
+
+def render_entry_fresh(entry: dict | None) -> bool:
+    if not entry:
+        return False
+    checked = datetime.fromisoformat(entry["checked_at"])
+    return (datetime.now() - checked).total_seconds() < RENDER_HISTORY_DAYS * 86400
+
+def plan_render_modes(seeds: list, history: dict) -> dict:
+    """Separar seeds entre crawl padrão e headless conforme o histórico
+    
+    Só usa headless para hosts onde ele já encontrou mais endpoints que o
+    crawl padrão; hosts desconhecidos ou com histórico expirado começam no
+    modo padrão e recebem headless como complemento se o resultado for pobre.
+    """
+    plan = {"standard": [], "headless": []}
+    for seed in seeds:
+        entry = history.get(render_host(seed))
+        mode = entry["mode"] if render_entry_fresh(entry) else "standard"
+        plan[mode].append(seed)
+    return plan
+
+async def run_katana(category: str, seeds: list, headless: bool, budget: UrlBudget, jsonl, on_url=None,
+                     deadline: Deadline | None = None):
+    """Executar uma instância do katana e repassar as URLs descobertas
+    
+    O katana roda em um grupo de processos próprio; no fim do orçamento de
+    URLs, no prazo ou em cancelamento o grupo inteiro (Chromium incluso) é
+    encerrado, e as URLs já repassadas continuam valendo.
+    """
+    deadline = deadline or Deadline(CRAWL_BUDGET_SECONDS)
+    mode = "headless" if headless else "standard"
+    # Um arquivo por execução: etapas da mesma categoria rodam o katana em paralelo
+    list_file = f"{DATA_DIR}/{category}_{mode}_{uuid.uuid4().hex[:8]}.txt"
+    with open(list_file, "w") as f:
+        f.write("\n".join(seeds) + "\n")
+    
+    # Comando katana com lista de URLs e JSONL
+    cmd = [
+        KATANA_BINARY,
+        "-list", list_file,
+        "-jsonl",
+        "-d", "1",      # profundidade
+        "-c", "5",      # antes era 10
+        "-omit-raw",    # stdout é lido em streaming; corpo/raw não são usados
+        "-omit-body"
+    ]
+    if headless:
+        cmd.append("-headless")
+    
+    logger.info(f"Running katana ({mode}) for {category}: {' '.join(cmd)}")
+    
+    async with admission.slot(category, mode, timeout=deadline.remaining()) as slot:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=KATANA_LINE_LIMIT,
+            start_new_session=True
+        )
+        slot.track(process.pid)
+        stderr_task = asyncio.create_task(drain_stream(process.stderr, label=f"katana {category} {mode}"))
+        stopped = {}
+    
+        async def stop_when_done():
+            try:
+                await asyncio.wait_for(budget.exhausted.wait(), deadline.remaining())
+                stopped["reason"] = "budget"
+                logger.info(f"URL budget reached for {category}, stopping katana ({mode})")
+            except asyncio.TimeoutError:
+                stopped["reason"] = "deadline"
+                logger.warning(f"Deadline reached for {category}, stopping katana ({mode})")
+            await terminate_process_group(process)
+    
+        stopper = asyncio.create_task(stop_when_done())
+        try:
+            # Ler URLs do stdout conforme o katana descobre
+            async for raw_line in process.stdout:
+                line = raw_line.decode(errors="replace")
+                url = extract_katana_url(line)
+                if url and budget.add(url, line):
+                    jsonl.write(line if line.endswith("\n") else line + "\n")
+                    if on_url is not None:
+                        await on_url(url)
+        
+            stderr = await stderr_task
+            await process.wait()
+            if process.returncode != 0 and not stopped:
+                raise Exception(f"Katana ({mode}) failed: {stderr.decode(errors='replace')}")
+        finally:
+            stopper.cancel()
+            if process.returncode is None:
+                # Cancelado (cliente desconectou) ou erro na leitura
+                await terminate_process_group(process, grace=0)
+            # Não deixar tarefas órfãs lendo o stderr do processo encerrado
+            stderr_task.cancel()
+            await asyncio.gather(stopper, stderr_task, return_exceptions=True)
+            os.remove(list_file)
+
+async def run_katana_analysis(category: str, on_url=None, limit: int = URL_BUDGET,
+                              deadline: Deadline | None = None) -> list:
+    """Descobrir URLs da categoria: sitemaps das raízes, katana para o resto
+    
+    Seeds na raiz do site com sitemap utilizável têm suas URLs (mais recentes
+    primeiro) repassadas direto; seeds profundos vão para o katana sem esperar
+    a descoberta por sitemap. Os seeds do katana são divididos entre crawl padrão e headless
+    pelo planejador de renderização; as URLs do katana são lidas do stdout
+    (-jsonl) conforme descobertas e repassadas para `on_url`, e o katana é
+    encerrado quando o orçamento de URLs é atingido.
+    """
+    budget = UrlBudget(limit)
     try:
         # Verificar se existe lista de URLs para a categoria
         urls_list_file = f"{CONFIG_DIR}/{category}.txt"
@@ -176,108 +1657,312 @@ async def run_katana_analysis(category: str) -> list:
             logger.warning(f"URL list not found for {category}, creating default")
             await create_default_url_list(category)
         
-        # Comando katana com lista de URLs e JSONL
-        cmd = [
-            KATANA_BINARY,
-            "-list", urls_list_file,
-            "-jsonl",
-            "-d", "1",      # profundidade
-            "-c", "5",      # antes era 10
-            "-headless",
-            "-o", f"{DATA_DIR}/{category}.jsonl"
-        ]
-        
-        logger.info(f"Running katana for {category}: {' '.join(cmd)}")
-        
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        with open(urls_list_file, "r") as f:
+            seeds = [line.strip() for line in f if line.strip()]
         
-        stdout, stderr = await process.communicate()
+        budget = UrlBudget(limit, len({render_host(seed) for seed in seeds}))
+        history = load_render_history()
+        standard_seeds = []
         
-        if process.returncode != 0:
-            raise Exception(f"Katana failed: {stderr.decode()}")
+        # O JSONL da categoria é escrito a partir dos sitemaps e do stdout do katana
+        with open(f"{DATA_DIR}/{category}.jsonl", "w") as jsonl:
+            async def katana_stage(stage: str, group_seeds: list):
+                if not group_seeds:
+                    return
+                plan = plan_render_modes(group_seeds, history)
+                standard_seeds.extend(plan["standard"])
+                logger.info(
+                    f"Discovery plan for {category} ({stage}): "
+                    f"{len(plan['standard'])} standard, {len(plan['headless'])} headless"
+                )
+                runs = [
+                    run_katana(category, group, mode == "headless", budget, jsonl, on_url, deadline)
+                    for mode, group in plan.items() if group and not budget.exhausted.is_set()
+                ]
+                for result in await asyncio.gather(*runs, return_exceptions=True):
+                    if isinstance(result, Exception):
+                        logger.error(f"Katana analysis failed: {result}")
+            
+            async def sitemap_stage(root_seeds: list):
+                sitemaps = await discover_sitemaps(root_seeds, deadline)
+                logger.info(f"Sitemap discovery for {category}: {len(sitemaps)}/{len(root_seeds)} seeds usable")
+                for seed, entries in sitemaps.items():
+                    # A home do seed primeiro, depois as páginas mais recentes
+                    for url, lastmod in [(seed, "")] + entries:
+                        line = json.dumps({"url": url, "source": "sitemap", "lastmod": lastmod or None}) + "\n"
+                        if budget.add(url, line):
+                            jsonl.write(line)
+                            if on_url is not None:
+                                await on_url(url)
+                # Seeds sem sitemap utilizável seguem para o katana
+                await katana_stage("no sitemap", [seed for seed in root_seeds if seed not in sitemaps])
+            
+            # Seeds profundos vão direto para o katana, em paralelo com os sitemaps das raízes
+            root_seeds = [seed for seed in seeds if is_root_seed(seed)]
+            await asyncio.gather(
+                katana_stage("deep seeds", [seed for seed in seeds if seed not in root_seeds]),
+                sitemap_stage(root_seeds)
+            )
+            
+            # Complementar com headless os hosts em que o crawl padrão foi pobre
+            standard_counts = {render_host(seed): budget.per_host[render_host(seed)] for seed in standard_seeds}
+            retry = []
+            for seed in standard_seeds:
+                entry = history.get(render_host(seed))
+                if standard_counts[render_host(seed)] >= RENDER_MIN_ENDPOINTS:
+                    continue
+                if render_entry_fresh(entry) and entry.get("headless_insufficient"):
+                    continue
+                retry.append(seed)
+            if retry and not budget.exhausted.is_set() and not (deadline and deadline.expired()):
+                try:
+                    await run_katana(category, retry, True, budget, jsonl, on_url, deadline)
+                except Exception as e:
+                    logger.error(f"Katana analysis failed: {e}")
+            
+            # Sobras das cotas por host e assets completam o orçamento, em rodízio
+            for url, line in budget.fill():
+                jsonl.write(line if line.endswith("\n") else line + "\n")
+                if on_url is not None:
+                    await on_url(url)
         
-        # Ler URLs coletadas do JSONL
-        urls = []
-        jsonl_file = f"{DATA_DIR}/{category}.jsonl"
-        if os.path.exists(jsonl_file):
-            with open(jsonl_file, "r") as f:
-                for line in f:
-                    if line.strip():
-                        try:
-                            item = json.loads(line)
-                            url = item.get("url", "")
-                            if url:
-                                urls.append(url)
-                        except json.JSONDecodeError:
-                            continue
+        # Atualizar histórico (contagens parciais só contam se o orçamento não acabou)
+        now = datetime.now().isoformat()
+        retried = {render_host(seed) for seed in retry}
+        updates = {}
+        for host, standard_count in standard_counts.items():
+            if host not in retried:
+                if standard_count >= RENDER_MIN_ENDPOINTS:
+                    updates[host] = {"mode": "standard", "standard": standard_count, "checked_at": now}
+                continue
+            if budget.exhausted.is_set() or (deadline and deadline.expired()):
+                continue
+            headless_count = budget.per_host[host]
+            needs_headless = headless_count >= RENDER_HEADLESS_GAIN * max(standard_count, 1)
+            updates[host] = {
+                "mode": "headless" if needs_headless else "standard",
+                "standard": standard_count,
+                "headless": headless_count,
+                "headless_insufficient": not needs_headless,
+                "checked_at": now
+            }
+        await asyncio.to_thread(save_render_history, updates)
         
-        logger.info(f"Katana collected {len(urls)} URLs for {category}")
-        return urls[:30]  # Limite de 30 URLs
+        logger.info(f"Collected {len(budget.urls)} URLs for {category}")
+        return budget.urls
         
     except Exception as e:
         logger.error(f"Katana analysis failed: {e}")
-        return []
+        return budget.urls
 
-async def run_scrapy_analysis(urls: list, category: str) -> dict:
-    """Executar Scrapy usando JSONL gerado pelo katana"""
-    try:
-        jsonl_file = f"{DATA_DIR}/{category}.jsonl"
-        output_file = f"{DATA_DIR}/{category}_seo.json"
-        
-        # Verificar se JSONL existe
-        if not os.path.exists(jsonl_file):
-            logger.warning(f"JSONL file not found: {jsonl_file}")
-            return {"pages": []}
-        
-        # Executar Scrapy via script auxiliar para evitar depender de projeto completo
-        cmd = [
-            "python3",
-            SCRAPY_SCRIPT,
-            "--input",
-            jsonl_file,
-            "--output",
-            output_file,
-            "--category",
-            category,
-            "--limit",
-            "30"
-        ]
-
-        logger.info(f"Running scrapy for {category} using script: {' '.join(cmd)}")
-
-        # Executar no diretório do katana-custom
-        process = await asyncio.create_subprocess_exec(
+async def run_crawl_pipeline(category: str, deadline: Deadline | None = None) -> tuple:
+    """Executar katana e scrapy em pipeline
+    
+    O scrapy é iniciado junto com o katana e recebe as URLs pelo stdin
+    (`--input -`) conforme são descobertas, em vez de esperar o katana terminar.
+    O katana tem KATANA_BUDGET_SHARE do prazo; o scrapy vai até o fim do prazo
+    e, se estourar, recebe SIGTERM e grava o que já coletou.
+    """
+    deadline = deadline or Deadline(CRAWL_BUDGET_SECONDS)
+    # Gravar em arquivo de staging; run_category_crawl só o promove se houver páginas
+    output_file = staging_output_file(category)
+    timings = {}
+    started = time.monotonic()
+    
+    # Executar Scrapy via script auxiliar para evitar depender de projeto completo
+    cmd = [
+        "python3",
+        SCRAPY_SCRIPT,
+        "--input",
+        "-",
+        "--output",
+        output_file,
+        "--category",
+        category,
+        "--limit",
+        str(URL_BUDGET),
+        "--shards",
+        str(SCRAPY_SHARDS),
+        "--max-page-bytes",
+        str(MAX_PAGE_BYTES_BY_CATEGORY.get(category, MAX_PAGE_BYTES)),
+        "--format",
+        SEO_OUTPUT_FORMAT,
+        "--robots-cache-dir",
+        f"{DATA_DIR}/robotstxt",
+        "--dns-cache-file",
+        f"{DATA_DIR}/dnscache.json",
+    ]
+    # Resolver DNS dos seeds enquanto o katana ainda descobre URLs
+    seeds_file = f"{CONFIG_DIR}/{category}.txt"
+    if os.path.exists(seeds_file):
+        cmd += ["--warmup-hosts", seeds_file]
+    if SCRAPY_CONVERGE:
+        cmd.append("--converge")
+    
+    logger.info(f"Running scrapy for {category} using script: {' '.join(cmd)}")
+    
+    # Executar no diretório do katana-custom; o scrapy é só monitorado pela
+    # admissão, pois espera o katana da categoria e não pode bloqueá-lo
+    async with admission.slot(category, "scrapy", wait=False) as scrapy_slot:
+        scrapy_process = await asyncio.create_subprocess_exec(
             *cmd,
-            stdout=asyncio.subprocess.PIPE,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
             stderr=asyncio.subprocess.PIPE,
-            cwd="/app"  # Executar no diretório raiz onde está o scrapy.cfg
+            cwd=APP_DIR,  # Executar no diretório raiz onde está o scrapy.cfg
+            start_new_session=True
         )
-        
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode != 0:
-            logger.warning(f"Scrapy output: {stderr.decode()}")
-        
-        # Ler dados coletados
+        scrapy_slot.track(scrapy_process.pid)
+        scrapy_stderr_task = asyncio.create_task(drain_stream(scrapy_process.stderr, label=f"scrapy {category}"))
+    
+        async def feed_scrapy(url: str):
+            if "first_url" not in timings:
+                timings["first_url"] = round(time.monotonic() - started, 3)
+            if "scrapy_stopped" in timings:
+                return
+            try:
+                scrapy_process.stdin.write((json.dumps({"url": url}) + "\n").encode())
+                await scrapy_process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # Esperado com --converge: o scrapy encerra antes do katana
+                timings["scrapy_stopped"] = round(time.monotonic() - started, 3)
+                logger.info(f"Scrapy stopped reading URLs for {category}")
+    
         try:
-            if os.path.exists(output_file):
-                with open(output_file, "r") as f:
-                    return json.load(f)
-            else:
-                logger.warning(f"Scrapy output file not created: {output_file}")
-                return {"pages": []}
-        except Exception as read_error:
-            logger.error(f"Error reading scrapy output: {read_error}")
+            urls = await run_katana_analysis(
+                category, on_url=feed_scrapy, deadline=deadline.stage(KATANA_BUDGET_SHARE)
+            )
+            timings["katana_done"] = round(time.monotonic() - started, 3)
+            if not scrapy_process.stdin.is_closing():
+                scrapy_process.stdin.close()
+            try:
+                await asyncio.wait_for(asyncio.shield(scrapy_process.wait()), deadline.remaining())
+            except asyncio.TimeoutError:
+                timings["scrapy_deadline"] = round(time.monotonic() - started, 3)
+                logger.warning(f"Deadline reached for {category}, stopping scrapy with partial results")
+                await terminate_process_group(scrapy_process)
+            stderr = await scrapy_stderr_task
+        finally:
+            if not scrapy_process.stdin.is_closing():
+                scrapy_process.stdin.close()
+            if scrapy_process.returncode is None:
+                # Cancelado: cliente desconectou
+                await terminate_process_group(scrapy_process, grace=0)
+            scrapy_stderr_task.cancel()
+            await asyncio.gather(scrapy_stderr_task, return_exceptions=True)
+    timings["scrapy_done"] = round(time.monotonic() - started, 3)
+    
+    # Tempo em que katana e scrapy trabalharam em paralelo
+    if "first_url" in timings:
+        timings["overlap"] = round(timings["katana_done"] - timings["first_url"], 3)
+    logger.info(f"Pipeline timings for {category}: {timings}")
+    
+    if scrapy_process.returncode != 0:
+        logger.warning(f"Scrapy output: {stderr.decode(errors='replace')}")
+    
+    if not urls:
+        return urls, {"pages": []}, timings
+    return urls, read_seo_output(output_file), timings
+
+def read_seo_output(output_file: str) -> dict:
+    """Ler dados coletados pelo scrapy (registros binários ou JSON)"""
+    try:
+        if is_record_file(output_file):
+            return read_records(output_file)
+        if os.path.exists(output_file):
+            with open(output_file, "r") as f:
+                return json.load(f)
+        else:
+            logger.warning(f"Scrapy output file not created: {output_file}")
             return {"pages": []}
-        
-    except Exception as e:
-        logger.error(f"Scrapy analysis failed: {e}")
+    except Exception as read_error:
+        logger.error(f"Error reading scrapy output: {read_error}")
         return {"pages": []}
 
+INSIGHTS_TOP_DOMAINS = 20  # Domínios listados no domainBreakdown
+URL_HOST_PATTERN = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*://(?:[^@/?#]*@)?(?:www\.)?([^/:?#]*)")
+
+def insight_columns(source: dict) -> tuple:
+    """Colunas dos insights: (colunas, códigos de domínio, nomes de domínio)
+    
+    ``source`` tem as colunas de tutorial.records.COLUMNS, entregues pelo
+    leitor de registros ou montadas por page_columns a partir do JSON.
+    """
+    columns = {
+        "title_length": list(map(len, source["title"])),
+        "meta_length": list(map(len, source["meta_description"])),
+        "h1_count": source["h1_count"],
+        "word_count": source["word_count"]
+    }
+    # Regex em vez de urlparse, e uma vez por origem: é o custo dominante com dezenas de milhares de páginas
+    domain_codes = {}
+    origin_codes = {}
+    codes = []
+    for url in source["url"]:
+        slash = url.find("/", url.find("//") + 2)
+        origin = url[:slash] if slash >= 0 else url
+        code = origin_codes.get(origin)
+        if code is None:
+            match = URL_HOST_PATTERN.match(url)
+            domain = match.group(1).lower() if match else ""
+            code = origin_codes[origin] = domain_codes.setdefault(domain, len(domain_codes))
+        codes.append(code)
+    return columns, codes, list(domain_codes)
+
+def seo_scores(columns: dict) -> list:
+    """Mesma regra de calculate_seo_score, aplicada a todas as páginas de uma vez"""
+    return [
+        min(100, 50 + 15 * (t > 30) + 15 * (m > 120) + 10 * (h > 0) + 10 * (w > 300))
+        for t, m, h, w in zip(
+            columns["title_length"], columns["meta_length"], columns["h1_count"], columns["word_count"]
+        )
+    ]
+
+def column_summary(values: list, default: float, positive_only: bool = True) -> dict:
+    """Média, p50 e p90 de uma coluna (ignorando zeros, como as médias originais)"""
+    selected = sorted(values)
+    if positive_only:
+        # Colunas de contagens e tamanhos: os zeros ficam no início
+        selected = selected[bisect.bisect_right(selected, 0):]
+    if not selected:
+        return {"mean": default, "p50": default, "p90": default}
+    return {
+        "mean": sum(selected) / len(selected),
+        "p50": percentile(selected, 0.5),
+        "p90": percentile(selected, 0.9)
+    }
+
+def score_distribution(scores: list) -> dict:
+    """Resumo dos scores e histograma por faixa de 10 pontos (50, 60, ..., 100)"""
+    summary = column_summary(scores, 0, positive_only=False)
+    buckets = Counter(score // 10 for score in scores)
+    return {
+        "mean": round(summary["mean"], 1),
+        "p50": round(summary["p50"], 1),
+        "p90": round(summary["p90"], 1),
+        "histogram": {str(10 * bucket): buckets[bucket] for bucket in range(5, 11)}
+    }
+
+def domain_breakdown(columns: dict, codes: list, domains: list, scores: list) -> list:
+    """Páginas, score médio e palavras médias por domínio (os maiores primeiro)"""
+    pages, score_sums, word_sums, word_pages = ([0] * len(domains) for _ in range(4))
+    for code, score, words in zip(codes, scores, columns["word_count"]):
+        pages[code] += 1
+        score_sums[code] += score
+        if words > 0:
+            word_sums[code] += words
+            word_pages[code] += 1
+    order = sorted(range(len(domains)), key=lambda i: -pages[i])[:INSIGHTS_TOP_DOMAINS]
+    return [
+        {
+            "domain": domains[i],
+            "pages": pages[i],
+            "avgScore": round(score_sums[i] / pages[i], 1),
+            "avgWordCount": int(word_sums[i] / word_pages[i]) if word_pages[i] else 0
+        }
+        for i in order
+    ]
+
 def process_category_insights(seo_data: dict, category: str) -> dict:
     """Processar dados coletados em insights para o ICMS"""
     pages = seo_data.get("pages", [])
@@ -286,18 +1971,19 @@ def process_category_insights(seo_data: dict, category: str) -> dict:
         # Retornar dados padrão se não conseguir coletar
         return get_fallback_insights(category)
     
-    # Calcular métricas
-    titles = [p.get("title", "") for p in pages if p.get("title")]
-    metas = [p.get("meta_description", "") for p in pages if p.get("meta_description")]
-    word_counts = [p.get("word_count", 0) for p in pages if p.get("word_count", 0) > 0]
+    # Calcular métricas sobre as colunas
+    source = seo_data.get("columns") or page_columns(pages)
+    columns, codes, domains = insight_columns(source)
+    scores = seo_scores(columns)
+    title_stats = column_summary(columns["title_length"], 50)
+    meta_stats = column_summary(columns["meta_length"], 140)
+    word_stats = column_summary(columns["word_count"], 350)
     
-    avg_title_length = sum(len(t) for t in titles) / len(titles) if titles else 50
-    avg_meta_length = sum(len(m) for m in metas) / len(metas) if metas else 140
-    avg_word_count = sum(word_counts) / len(word_counts) if word_counts else 350
-    
-    # Extrair keywords comuns
-    all_text = " ".join([p.get("title", "") + " " + p.get("meta_description", "") for p in pages])
-    keywords = extract_common_keywords(all_text, category)
+    # Keywords comuns: o scrapy-runner já grava as contagens; saídas antigas são tokenizadas aqui
+    counts = seo_data.get("keyword_counts")
+    if counts is None:
+        counts = keyword_counts(source["title"] + source["meta_description"])
+    keywords = [word for word, _count in Counter(counts).most_common(6)]
     
     # Preparar exemplos de concorrentes
     competitor_examples = []
@@ -312,9 +1998,15 @@ def process_category_insights(seo_data: dict, category: str) -> dict:
     
     return {
         "category": category,
-        "avgTitleLength": int(avg_title_length),
-        "avgMetaLength": int(avg_meta_length),
-        "avgWordCount": int(avg_word_count),
+        "avgTitleLength": int(title_stats["mean"]),
+        "avgMetaLength": int(meta_stats["mean"]),
+        "avgWordCount": int(word_stats["mean"]),
+        "percentiles": {
+            name: {"p50": int(stats["p50"]), "p90": int(stats["p90"])}
+            for name, stats in (("titleLength", title_stats), ("metaLength", meta_stats), ("wordCount", word_stats))
+        },
+        "scoreDistribution": score_distribution(scores),
+        "domainBreakdown": domain_breakdown(columns, codes, domains, scores),
         "commonKeywords": keywords,
         "bestPractices": {
             "titlePatterns": [
@@ -336,27 +2028,14 @@ def process_category_insights(seo_data: dict, category: str) -> dict:
             ]
         },
         "competitorExamples": competitor_examples,
-        "analysisDate": datetime.now().isoformat(),
+        "analysisDate": seo_data.get("generated_at") or datetime.now().isoformat(),
         "pagesAnalyzed": len(pages)
     }
 
 def extract_common_keywords(text: str, category: str) -> list:
     """Extrair keywords mais comuns do texto"""
-    import re
-    from collections import Counter
-    
-    # Remover pontuação e converter para minúsculas
-    words = re.findall(r'\b[a-záàâãéèêíïóôõöúçñ]{3,}\b', text.lower())
-    
-    # Filtrar stop words básicas
-    stop_words = {'que', 'para', 'com', 'uma', 'seu', 'sua', 'nos', 'das', 'dos', 'mais', 'como', 'por', 'são', 'tem', 'ter', 'foi', 'pelo', 'pela'}
-    words = [w for w in words if w not in stop_words]
-    
-    # Contar frequências
-    counter = Counter(words)
-    
-    # Retornar top 6 keywords
-    return [word for word, count in counter.most_common(6)]
+    # Top 6 keywords, sem stop words
+    return [word for word, count in keyword_counts([text]).most_common(6)]
 
 def calculate_seo_score(page: dict) -> int:
     """Calcular score SEO de uma página"""
@@ -373,8 +2052,28 @@ def calculate_seo_score(page: dict) -> int:
     
     return min(100, score)
 
+def snapshot_insights(snapshot: dict) -> dict:
+    """Insights de um snapshot do histórico, marcados como dado antigo"""
+    insights = dict(snapshot["insights"])
+    insights["stale"] = True
+    insights["snapshotVersion"] = snapshot["version"]
+    insights["snapshotDate"] = snapshot["createdAt"]
+    return insights
+
 def get_fallback_insights(category: str) -> dict:
-    """Dados de fallback quando não conseguir scraping"""
+    """Dados de fallback quando não conseguir scraping
+    
+    Usa o último snapshot bom da categoria; sem histórico, só barbearia e
+    mercearia têm valores próprios e as demais recebem valores neutros.
+    """
+    try:
+        snapshot = snapshots.latest(category)
+    except Exception as e:
+        logger.error(f"Could not read insights snapshot for {category}: {e}")
+        snapshot = None
+    if snapshot is not None:
+        return snapshot_insights(snapshot)
+    
     fallback_data = {
         "barbearia": {
             "keywords": ["corte masculino", "barba", "cabelo", "barbeiro", "salão", "estilo"],
@@ -386,7 +2085,7 @@ def get_fallback_insights(category: str) -> dict:
         }
     }
     
-    data = fallback_data.get(category, fallback_data["barbearia"])
+    data = fallback_data.get(category, {"keywords": [], "avgTitle": 50, "avgMeta": 140, "avgWords": 350})
     
     return {
         "category": category,
@@ -406,23 +2105,28 @@ def get_fallback_insights(category: str) -> dict:
 async def refresh_category_background(category: str):
     """Refresh dados de categoria em background"""
     try:
-        logger.info(f"Background refresh started for {category}")
-        
-        urls = await run_katana_analysis(category)
-        seo_data = await run_scrapy_analysis(urls, category)
-        
-        # Salvar cache atualizado
-        cache_file = f"{DATA_DIR}/{category}_cache.json"
-        cache_data = {
-            "category": category,
-            "last_updated": datetime.now().isoformat(),
-            "urls_count": len(urls),
-            "pages_analyzed": len(seo_data.get("pages", []))
-        }
-        
-        with open(cache_file, "w") as f:
-            json.dump(cache_data, f)
+        async with refresh_lease(category) as acquired:
+            if not acquired:
+                logger.info(f"Refresh of {category} already running on another worker, skipping")
+                return
+            
+            # Outro worker pode ter concluído o refresh enquanto este esperava
+            hours_diff = cache_age_hours(category)
+            if hours_diff is not None and hours_diff < CACHE_EXPIRY_HOURS:
+                logger.info(f"{category} was refreshed by another worker, skipping")
+                return
+            
+            failure = await asyncio.to_thread(snapshots.recent_failure, category, REFRESH_FAILURE_BACKOFF_SECONDS)
+            if failure is not None:
+                logger.info(f"Last refresh of {category} failed at {failure['failedAt']}, skipping")
+                return
+            
+            logger.info(f"Background refresh started for {category}")
+            urls, seo_data, collected = await run_category_crawl(category)
         
+        if not collected:
+            logger.warning(f"Background refresh of {category} collected no pages, keeping previous data")
+            return
         logger.info(f"Background refresh completed for {category}: {len(urls)} URLs, {len(seo_data.get('pages', []))} pages")
         
     except Exception as e:
@@ -471,4 +2175,4 @@ if __name__ == "__main__":
     except ImportError as exc:
         raise RuntimeError("uvicorn is required to run the API server locally. Install it via pip.") from exc
 
-    uvicorn.run(app, host="0.0.0.0", port=3001)
+    uvicorn.run(app, host="0.0.0.0", port=API_PORT)
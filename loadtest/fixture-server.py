@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Local web server standing in for competitor sites during load tests.
+
+Responses recorded in Katana JSONL files (``response.body``) are served under
+``/{original host}{original path}``, the layout produced by
+loadtest/stub-katana.py. Other ``.html`` and ``/`` paths get a deterministic
+synthetic page with title, meta description, h1 and body text, so the
+scrapy-runner has HTML to analyse. Every response can be delayed and a
+fraction of them replaced by server errors.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_RECORDING = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "boa.jsonl")
+
+WORDS = (
+    "corte barba cabelo atendimento qualidade agendamento estilo produtos entrega oficina "
+    "revisão pneus alinhamento mercado frescos promoção horário localização contato serviço "
+    "profissional preço desconto cliente equipe experiência conforto rápido centro bairro"
+).split()
+
+
+def load_recordings(paths: list) -> dict:
+    """Map ``/{host}{path}?{query}`` to (status, content type, body bytes)."""
+    recorded = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                    endpoint = record["request"]["endpoint"]
+                    response = record.get("response") or {}
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+                if response.get("body") is None:
+                    continue
+                parsed = urlparse(endpoint)
+                key = f"/{parsed.netloc}{parsed.path or '/'}" + (f"?{parsed.query}" if parsed.query else "")
+                headers = {name.lower(): value for name, value in (response.get("headers") or {}).items()}
+                recorded[key] = (
+                    int(response.get("status_code") or 200),
+                    headers.get("content-type", "application/octet-stream"),
+                    response["body"].encode("utf-8"),
+                )
+    logger.info("Loaded %s recorded responses", len(recorded))
+    return recorded
+
+
+def synthetic_page(path: str) -> bytes:
+    """Deterministic HTML page derived from the request path."""
+    rng = random.Random(hashlib.sha256(path.encode("utf-8")).digest())
+    title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 9))).capitalize()
+    meta = " ".join(rng.choice(WORDS) for _ in range(rng.randint(12, 24))).capitalize()
+    paragraphs = "\n".join(
+        f"<p>{' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120)))}</p>"
+        for _ in range(rng.randint(2, 6))
+    )
+    base = path.rsplit("/", 1)[0]
+    links = "\n".join(f'<a href="{base}/page-{rng.randint(0, 50)}.html">mais</a>' for _ in range(5))
+    return (
+        "<!DOCTYPE html>\n<html lang=\"pt-BR\"><head><meta charset=\"utf-8\">"
+        f"<title>{title}</title><meta name=\"description\" content=\"{meta}\"></head>\n"
+        f"<body><h1>{title}</h1>\n{paragraphs}\n{links}\n</body></html>\n"
+    ).encode("utf-8")
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    server_version = "FixtureServer/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        config = self.server.config
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        path = self.path
+        if random.random() < config.error_rate and path != "/robots.txt":
+            self.reply(config.error_status, "text/plain", b"fixture error\n", "error")
+        elif path == "/robots.txt":
+            self.reply(200, "text/plain", b"User-agent: *\nAllow: /\n", "robots")
+        elif path in self.server.recorded:
+            status, content_type, body = self.server.recorded[path]
+            self.reply(status, content_type, body, "recorded")
+        elif urlparse(path).path.endswith(("/", ".html")):
+            self.reply(200, "text/html; charset=utf-8", synthetic_page(urlparse(path).path), "synthetic")
+        else:
+            self.reply(404, "text/plain", b"not found\n", "missing")
+
+    def reply(self, status: int, content_type: str, body: bytes, kind: str):
+        with self.server.lock:
+            self.server.served[kind] += 1
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded and synthetic pages for load tests")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind")
+    parser.add_argument("--port", type=int, default=8900, help="Port to bind")
+    parser.add_argument(
+        "--recording",
+        action="append",
+        dest="recordings",
+        help="Katana JSONL with recorded response bodies (repeatable, default: boa.jsonl)",
+    )
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Extra random delay, uniform in [0, jitter]")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.0, help="Fraction of errors")
+    parser.add_argument("--error-status", dest="error_status", type=int, default=503, help="Status of errors")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), FixtureHandler)
+    server.daemon_threads = True
+    server.config = args
+    server.recorded = load_recordings(args.recordings or [DEFAULT_RECORDING])
+    server.served = Counter()
+    server.lock = threading.Lock()
+    logger.info("Fixture server listening on http://%s:%s", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info("Responses served: %s", dict(server.served))
+
+
+if __name__ == "__main__":
+    main()
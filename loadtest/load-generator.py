@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""Drive the Katana API with cold-cache, warm-cache and burst scenarios.
+
+By default the harness runs fully offline: it starts loadtest/fixture-server.py,
+writes seed lists pointing at it, and starts katana-api-server.py with
+KATANA_BINARY set to loadtest/stub-katana.py and data/config directories in a
+scratch directory. Pass ``--base-url`` to target a server that is already
+running instead.
+
+For every scenario the report has request counts, status codes, throughput,
+p50/p95/p99 latency per endpoint, and the number of katana/scrapy subprocesses
+the server started (sampled from /proc under the server pid).
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger(__name__)
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(LOADTEST_DIR)
+SCENARIOS = ("cold", "warm", "burst")
+
+sys.path.insert(0, REPO_DIR)
+from tutorial.stats import percentile  # noqa: E402
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    ordered = sorted(latencies)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1),
+    }
+
+
+def http_request(base_url: str, method: str, path: str, timeout: float) -> tuple:
+    """Send one request; returns (status, seconds). Status 0 means a transport error."""
+    request = urllib.request.Request(f"{base_url}{path}", method=method, data=b"" if method == "POST" else None)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as exc:
+        exc.read()
+        status = exc.code
+    except (OSError, ValueError):
+        status = 0
+    return status, time.perf_counter() - started
+
+
+class ProcessSampler:
+    """Poll /proc for katana and scrapy-runner processes under the server pid."""
+
+    def __init__(self, root_pid: int, interval: float = 0.1):
+        self.root_pid = root_pid
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.seen = defaultdict(set)
+        self.peak = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="process-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+    def reset(self):
+        with self.lock:
+            self.seen = defaultdict(set)
+            self.peak = Counter()
+
+    @staticmethod
+    def _classify(cmdline: str) -> str | None:
+        if "scrapy-runner" in cmdline:
+            return "scrapy"
+        if "-list" in cmdline:
+            return "katana"
+        return None
+
+    def _children(self) -> dict:
+        parents = {}
+        commands = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "r") as handle:
+                    stat = handle.read()
+                with open(f"/proc/{entry}/cmdline", "rb") as handle:
+                    cmdline = handle.read().replace(b"\0", b" ").decode(errors="replace")
+            except OSError:
+                continue
+            parents[int(entry)] = int(stat.rsplit(")", 1)[1].split()[1])
+            commands[int(entry)] = cmdline
+        descendants = {}
+        frontier = [self.root_pid]
+        while frontier:
+            parent = frontier.pop()
+            for pid, ppid in parents.items():
+                if ppid == parent and pid not in descendants:
+                    descendants[pid] = (ppid, commands[pid])
+                    frontier.append(pid)
+        return descendants
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            current = Counter()
+            with self.lock:
+                children = self._children()
+                for pid, (ppid, cmdline) in children.items():
+                    kind = self._classify(cmdline)
+                    if kind is None:
+                        continue
+                    # --shards workers are scrapy-runner children of the runner itself
+                    if kind == "scrapy" and ppid in children and self._classify(children[ppid][1]) == "scrapy":
+                        continue
+                    current[kind] += 1
+                    self.seen[kind].add(pid)
+                for kind, count in current.items():
+                    self.peak[kind] = max(self.peak[kind], count)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                kind: {"started": len(self.seen[kind]), "peak_concurrent": self.peak[kind]}
+                for kind in ("katana", "scrapy")
+            }
+
+
+def stub_invocations(log_path: str | None) -> int:
+    if not log_path or not os.path.exists(log_path):
+        return 0
+    with open(log_path, "r", encoding="utf-8") as handle:
+        return sum(1 for _line in handle)
+
+
+def run_scenario(name: str, calls: list, base_url: str, concurrency: int, timeout: float,
+                 sampler: ProcessSampler | None, stub_log: str | None, simultaneous: bool = False) -> dict:
+    """Issue (method, path, label) calls and summarise latencies per label."""
+    if not calls:
+        # A pool of 0 workers (or a Barrier(0)) raises ValueError
+        logger.warning("Scenario %s has no requests, skipping", name)
+        return {
+            "scenario": name,
+            "requests": 0,
+            "errors": 0,
+            "statuses": {},
+            "elapsed_seconds": 0.0,
+            "throughput_rps": 0.0,
+            "latency": latency_summary([]),
+            "endpoints": {},
+            "katana_invocations": 0 if stub_log else None,
+        }
+    if sampler is not None:
+        sampler.reset()
+    invocations_before = stub_invocations(stub_log)
+    barrier = threading.Barrier(len(calls)) if simultaneous else None
+
+    def issue(call):
+        if barrier is not None:
+            barrier.wait()
+        method, path, label = call
+        status, seconds = http_request(base_url, method, path, timeout)
+        return label, status, seconds
+
+    logger.info("Scenario %s: %s requests (concurrency %s)", name, len(calls), len(calls) if simultaneous else concurrency)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(calls) if simultaneous else concurrency) as pool:
+        results = list(pool.map(issue, calls))
+    elapsed = time.perf_counter() - started
+
+    by_label = defaultdict(list)
+    statuses = Counter()
+    for label, status, seconds in results:
+        by_label[label].append(seconds)
+        statuses[str(status)] += 1
+    errors = sum(count for status, count in statuses.items() if status == "0" or status.startswith("5"))
+    report = {
+        "scenario": name,
+        "requests": len(results),
+        "errors": errors,
+        "statuses": dict(statuses),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "latency": latency_summary([seconds for _label, _status, seconds in results]),
+        "endpoints": {label: latency_summary(values) for label, values in sorted(by_label.items())},
+        "katana_invocations": stub_invocations(stub_log) - invocations_before if stub_log else None,
+    }
+    if sampler is not None:
+        time.sleep(sampler.interval * 2)
+        report["subprocesses"] = sampler.snapshot()
+    return report
+
+
+def build_scenarios(args, categories: List[str]) -> dict:
+    rng = random.Random(args.seed)
+
+    def insights(category):
+        return ("GET", f"/api/category-insights/{category}", "GET insights")
+
+    scenarios = {
+        # Empty cache: every category crawled, duplicates must wait for the same crawl
+        "cold": [insights(category) for category in categories for _ in range(args.cold_repeat)],
+        "warm": [
+            rng.choice([insights(category), ("POST", f"/api/category-insights/{category}", "POST insights")])
+            for category in (categories[i % len(categories)] for i in range(args.requests))
+        ],
+    }
+    burst = []
+    for _ in range(args.burst):
+        roll = rng.random()
+        category = rng.choice(categories)
+        if roll < 0.1:
+            burst.append(("GET", "/health", "GET health"))
+        elif roll < 0.2:
+            burst.append(("POST", f"/api/refresh/{category}", "POST refresh"))
+        else:
+            burst.append(insights(category))
+    scenarios["burst"] = burst
+    return scenarios
+
+
+def wait_for_health(base_url: str, timeout: float, process: subprocess.Popen | None = None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"API server exited with status {process.returncode}, see api-server.log")
+        status, _seconds = http_request(base_url, "GET", "/health", 5)
+        if status == 200:
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"API server at {base_url} did not become healthy within {timeout}s")
+
+
+def start_environment(args, categories: List[str]) -> tuple:
+    """Start the fixture server and an API server wired to the stub katana."""
+    workdir = args.workdir or tempfile.mkdtemp(prefix="katana-loadtest-")
+    data_dir = os.path.join(workdir, "data")
+    config_dir = os.path.join(workdir, "config")
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(config_dir, exist_ok=True)
+    stub_log = os.path.join(workdir, "katana-invocations.jsonl")
+
+    fixture_url = f"http://127.0.0.1:{args.fixture_port}"
+    for category in categories:
+        seeds = [f"{fixture_url}/autocenterlopes.com.br/"]
+        seeds += [f"{fixture_url}/{category}-{index}.example/" for index in range(args.seeds_per_category - 1)]
+        with open(os.path.join(config_dir, f"{category}.txt"), "w", encoding="utf-8") as handle:
+            handle.write("\n".join(seeds) + "\n")
+
+    fixture_cmd = [
+        sys.executable,
+        os.path.join(LOADTEST_DIR, "fixture-server.py"),
+        "--port",
+        str(args.fixture_port),
+        "--latency",
+        str(args.fixture_latency),
+        "--jitter",
+        str(args.fixture_jitter),
+        "--error-rate",
+        str(args.fixture_error_rate),
+    ]
+    env = dict(os.environ)
+    env.update(
+        {
+            "KATANA_APP_DIR": REPO_DIR,
+            "KATANA_BINARY": os.path.join(LOADTEST_DIR, "stub-katana.py"),
+            "KATANA_DATA_DIR": data_dir,
+            "KATANA_CONFIG_DIR": config_dir,
+            "KATANA_API_PORT": str(args.port),
+            "STUB_KATANA_LOG": stub_log,
+            "STUB_KATANA_STARTUP_DELAY": str(args.katana_startup_delay),
+            "STUB_KATANA_LINE_DELAY": str(args.katana_line_delay),
+            "STUB_KATANA_FAIL_RATE": str(args.katana_fail_rate),
+        }
+    )
+    api_log = open(os.path.join(workdir, "api-server.log"), "wb")
+    fixture = subprocess.Popen(fixture_cmd, stdout=api_log, stderr=subprocess.STDOUT)
+    api = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "katana-api-server.py")],
+        cwd=REPO_DIR,
+        env=env,
+        stdout=api_log,
+        stderr=subprocess.STDOUT,
+    )
+    logger.info("Started fixture server (pid %s) and API server (pid %s) in %s", fixture.pid, api.pid, workdir)
+    return workdir, stub_log, [api, fixture]
+
+
+def stop_processes(processes: list):
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+    for process in processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def print_report(reports: list):
+    for report in reports:
+        print(
+            f"\n== {report['scenario']}: {report['requests']} requests in {report['elapsed_seconds']}s "
+            f"({report['throughput_rps']} req/s), {report['errors']} errors, statuses {report['statuses']}"
+        )
+        print(f"{'endpoint':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        rows = list(report["endpoints"].items()) + [("all", report["latency"])]
+        for label, stats in rows:
+            print(
+                f"{label:<16}{stats['count']:>7}{stats.get('p50_ms', 0):>10}{stats.get('p95_ms', 0):>10}"
+                f"{stats.get('p99_ms', 0):>10}{stats.get('max_ms', 0):>10}"
+            )
+        if report.get("subprocesses"):
+            procs = report["subprocesses"]
+            print(
+                f"subprocesses: katana {procs['katana']['started']} started "
+                f"(peak {procs['katana']['peak_concurrent']}), scrapy {procs['scrapy']['started']} started "
+                f"(peak {procs['scrapy']['peak_concurrent']}), stub invocations {report['katana_invocations']}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the Katana API server")
+    parser.add_argument("--base-url", dest="base_url", default=None, help="Target a running server instead")
+    parser.add_argument("--server-pid", dest="server_pid", type=int, default=None,
+                        help="Pid of the server given by --base-url, for subprocess counts")
+    parser.add_argument("--port", type=int, default=3101, help="Port for the API server started by the harness")
+    parser.add_argument("--fixture-port", dest="fixture_port", type=int, default=8900, help="Fixture server port")
+    parser.add_argument("--workdir", default=None, help="Directory for data/config/logs (default: a temp dir)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of cold,warm,burst")
+    parser.add_argument("--categories", type=int, default=3, help="Number of categories to exercise")
+    parser.add_argument("--category", action="append", dest="category_names",
+                        help="Category to exercise instead of loadtest-N (repeatable; use with --base-url)")
+    parser.add_argument("--seeds-per-category", dest="seeds_per_category", type=int, default=2)
+    parser.add_argument("--cold-repeat", dest="cold_repeat", type=int, default=2,
+                        help="Concurrent requests per category in the cold scenario")
+    parser.add_argument("--requests", type=int, default=200, help="Requests in the warm scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Client threads for cold/warm")
+    parser.add_argument("--burst", type=int, default=50, help="Requests released at once in the burst scenario")
+    parser.add_argument("--timeout", type=float, default=900, help="Per-request timeout in seconds")
+    parser.add_argument("--fixture-latency", dest="fixture_latency", type=float, default=0.05)
+    parser.add_argument("--fixture-jitter", dest="fixture_jitter", type=float, default=0.05)
+    parser.add_argument("--fixture-error-rate", dest="fixture_error_rate", type=float, default=0.0)
+    parser.add_argument("--katana-startup-delay", dest="katana_startup_delay", type=float, default=0.5)
+    parser.add_argument("--katana-line-delay", dest="katana_line_delay", type=float, default=0.05)
+    parser.add_argument("--katana-fail-rate", dest="katana_fail_rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the request mix")
+    parser.add_argument("--report", default=None, help="Write the JSON report to this path")
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    categories = args.category_names or [f"loadtest-{index}" for index in range(args.categories)]
+    if args.base_url and not args.category_names:
+        logger.warning("Categories without a seed list on the target server get its default (live) URLs")
+
+    processes = []
+    stub_log = None
+    server_pid = args.server_pid
+    base_url = args.base_url
+    try:
+        if base_url is None:
+            _workdir, stub_log, processes = start_environment(args, categories)
+            server_pid = processes[0].pid
+            base_url = f"http://127.0.0.1:{args.port}"
+        wait_for_health(base_url, 60, processes[0] if processes else None)
+
+        sampler = ProcessSampler(server_pid) if server_pid else None
+        if sampler is not None:
+            sampler.start()
+        scenarios = build_scenarios(args, categories)
+        reports = []
+        for name in selected:
+            reports.append(
+                run_scenario(
+                    name,
+                    scenarios[name],
+                    base_url,
+                    args.concurrency,
+                    args.timeout,
+                    sampler,
+                    stub_log,
+                    simultaneous=name == "burst",
+                )
+            )
+        if sampler is not None:
+            sampler.stop()
+    finally:
+        stop_processes(processes)
+
+    print_report(reports)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as handle:
+            json.dump({"base_url": base_url, "categories": categories, "scenarios": reports}, handle, indent=2)
+        logger.info("Report written to %s", args.report)
+
+
+if __name__ == "__main__":
+    main()
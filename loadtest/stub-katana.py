@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Stand-in for the katana binary that replays recorded JSONL output.
+
+The API server invokes KATANA_BINARY with fixed flags, so the stub is
+configured through environment variables:
+
+    STUB_KATANA_JSONL          recorded Katana JSONL to replay (default: boa.jsonl)
+    STUB_KATANA_PAGES          extra HTML page endpoints emitted per seed (default: 20)
+    STUB_KATANA_STARTUP_DELAY  seconds before the first line (default: 0.5)
+    STUB_KATANA_LINE_DELAY     seconds between lines (default: 0.05)
+    STUB_KATANA_FAIL_RATE      probability of exiting with an error (default: 0)
+    STUB_KATANA_LOG            file that gets one JSON line per invocation
+
+Recorded endpoints are rewritten onto each seed's origin as
+``{origin}/{original host}{original path}``, which is the layout served by
+loadtest/fixture-server.py.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import urlparse
+
+DEFAULT_RECORDING = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "boa.jsonl")
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def load_recording(path: str) -> list:
+    """Recorded lines as dicts; lines that are not Katana records are skipped."""
+    records = []
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and isinstance(record.get("request"), dict):
+                records.append(record)
+    return records
+
+
+def rebase(url: str, origin: str) -> str:
+    """Map a recorded URL onto the fixture server origin."""
+    parsed = urlparse(url)
+    path = parsed.path or "/"
+    query = f"?{parsed.query}" if parsed.query else ""
+    return f"{origin}/{parsed.netloc}{path}{query}"
+
+
+def replay(seed: str, records: list, pages: int, omit_body: bool):
+    """Yield the JSONL lines Katana would print for one seed."""
+    parsed = urlparse(seed)
+    origin = f"{parsed.scheme}://{parsed.netloc}"
+    for index in range(pages):
+        yield {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "request": {"method": "GET", "endpoint": f"{seed.rstrip('/')}/page-{index}.html", "source": seed},
+            "response": {"status_code": 200, "headers": {"content-type": "text/html; charset=utf-8"}},
+        }
+    for record in records:
+        request = dict(record["request"])
+        request["endpoint"] = rebase(request["endpoint"], origin)
+        if request.get("source"):
+            request["source"] = rebase(request["source"], origin)
+        request.pop("raw", None)
+        response = dict(record.get("response") or {})
+        response.pop("raw", None)
+        if omit_body:
+            response.pop("body", None)
+        yield {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "request": request, "response": response}
+
+
+def log_invocation(argv: list, seeds: list):
+    path = os.environ.get("STUB_KATANA_LOG")
+    if not path:
+        return
+    entry = {"pid": os.getpid(), "started_at": time.time(), "argv": argv, "seeds": len(seeds)}
+    with open(path, "a", encoding="utf-8") as handle:
+        handle.write(json.dumps(entry) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded Katana JSONL output", add_help=False, allow_abbrev=False
+    )
+    parser.add_argument("-list", dest="list_file")
+    parser.add_argument("-version", "--version", dest="version", action="store_true")
+    parser.add_argument("-omit-body", dest="omit_body", action="store_true")
+    args, _unknown = parser.parse_known_args()
+
+    if args.version:
+        print("katana stub (loadtest)")
+        return 0
+
+    seeds = []
+    if args.list_file:
+        with open(args.list_file, "r", encoding="utf-8") as handle:
+            seeds = [line.strip() for line in handle if line.strip()]
+    log_invocation(sys.argv[1:], seeds)
+
+    time.sleep(env_float("STUB_KATANA_STARTUP_DELAY", 0.5))
+    if random.random() < env_float("STUB_KATANA_FAIL_RATE", 0.0):
+        print("[FTL] stub failure requested by STUB_KATANA_FAIL_RATE", file=sys.stderr)
+        return 1
+
+    records = load_recording(os.environ.get("STUB_KATANA_JSONL", DEFAULT_RECORDING))
+    pages = int(env_float("STUB_KATANA_PAGES", 20))
+    line_delay = env_float("STUB_KATANA_LINE_DELAY", 0.05)
+    try:
+        for seed in seeds:
+            for record in replay(seed, records, pages, args.omit_body):
+                sys.stdout.write(json.dumps(record) + "\n")
+                sys.stdout.flush()
+                time.sleep(line_delay)
+    except BrokenPipeError:
+        return 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
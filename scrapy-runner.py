@@ -2,29 +2,107 @@
 """Utility script to run the Scrapy pipeline using Katana JSONL output."""
 
 import argparse
+import hashlib
 import json
 import logging
+import math
 import os
 import re
+import signal
+import subprocess
+import sys
+import threading
+from collections import Counter
 from datetime import datetime
 from typing import List
+from urllib.parse import urlparse
 
 try:
     import scrapy  # type: ignore
     from scrapy import signals  # type: ignore
     from scrapy.crawler import CrawlerProcess  # type: ignore
+    from scrapy.exceptions import CloseSpider, StopDownload  # type: ignore
+    from scrapy.utils.defer import maybe_deferred_to_future  # type: ignore
+    from twisted.internet.defer import DeferredQueue  # type: ignore
 except ModuleNotFoundError as exc:  # pragma: no cover
     raise RuntimeError(
         "Scrapy is required to run this script. Install dependencies with `pip install -r requirements.txt`."
     ) from exc
 
+from tutorial.stats import KEYWORD_PATTERN, STOP_WORDS, keyword_counts
+from tutorial.urls import url_rank
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Passing "-" as --input streams Katana JSONL from stdin while Katana is still running
+STDIN_INPUT = "-"
+
+# Caches relative to the working directory; the API server passes paths under its DATA_DIR
+ROBOTS_CACHE_DIR = "data/robotstxt"
+DNS_CACHE_FILE = "data/dnscache.json"
+
+
+def url_from_record(line: str) -> str | None:
+    """Extract the URL from one JSONL line (Katana format or simplified {"url": ...})."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        payload = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    request = payload.get("request")
+    if isinstance(request, dict) and request.get("endpoint"):
+        return request["endpoint"]
+    return payload.get("url") or None
+
+
+def write_output(path: str, payload: dict, output_format: str = "json") -> None:
+    """Write output via a temp file so the API server never reads a partial result.
+
+    ``bin`` uses the length-prefixed page record format from tutorial.records.
+    """
+    from tutorial.records import json_default, write_records
+
+    if output_format == "bin":
+        write_records(path, payload)
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        # Pages read back from a record file are PageRecords, not dicts
+        json.dump(payload, handle, ensure_ascii=False, indent=2, default=json_default)
+    os.replace(tmp_path, path)
+
+
+def request_priority(tier: int, host_index: int, depth: int) -> int:
+    """Scrapy priority: better tier first, then round-robin across hosts, then shallow paths."""
+    return -(tier * 1000 + min(host_index, 99) * 10 + min(depth, 9))
+
+
+def schedule_urls(urls: List[str], limit: int | None = None) -> List[tuple]:
+    """Rank URLs and interleave hosts; returns [(url, priority)] truncated to limit."""
+    by_host: dict = {}
+    for url in dict.fromkeys(urls):
+        by_host.setdefault((urlparse(url).hostname or "").lower(), []).append(url)
+
+    ranked = []
+    for host_urls in by_host.values():
+        host_urls.sort(key=url_rank)
+        for host_index, url in enumerate(host_urls):
+            tier, depth = url_rank(url)
+            ranked.append((request_priority(tier, host_index, depth), url))
+    ranked.sort(key=lambda entry: entry[0], reverse=True)
+    if limit:
+        ranked = ranked[:limit]
+    return [(url, priority) for priority, url in ranked]
+
 
 def load_urls_from_jsonl(path: str, limit: int | None = None) -> List[str]:
-    """Read Katana JSONL file and return list of URLs."""
+    """Read Katana JSONL file and return the scheduled list of URLs (see schedule_urls)."""
     if not os.path.exists(path):
         logger.warning("Katana JSONL file not found: %s", path)
         return []
@@ -32,19 +110,123 @@ def load_urls_from_jsonl(path: str, limit: int | None = None) -> List[str]:
     urls: List[str] = []
     with open(path, "r", encoding="utf-8") as handle:
         for line in handle:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                payload = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            url = payload.get("url")
+            url = url_from_record(line)
             if url:
                 urls.append(url)
-                if limit and len(urls) >= limit:
-                    break
-    return urls
+    return [url for url, _priority in schedule_urls(urls, limit)]
+
+
+# Default per-page byte budget (--max-page-bytes); 0 disables the size check
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+
+class RunningStat:
+    """Welford running mean/variance with a normal-approximation confidence interval."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def half_width(self, z: float) -> float:
+        if self.count < 2:
+            return math.inf
+        return z * math.sqrt(self.m2 / (self.count - 1) / self.count)
+
+
+class ConvergenceMonitor:
+    """Decide when the category metrics the API server derives have stabilised.
+
+    Converged means: at least ``min_pages`` pages, every tracked mean has a
+    confidence half-width within ``tolerance`` of its value, and the top-K
+    keyword set has not changed for ``stable_pages`` consecutive pages.
+    """
+
+    def __init__(self, min_pages: int = 8, tolerance: float = 0.1, top_k: int = 6, stable_pages: int = 5, z: float = 1.96):
+        self.min_pages = min_pages
+        self.tolerance = tolerance
+        self.top_k = top_k
+        self.stable_pages = stable_pages
+        self.z = z
+        self.pages = 0
+        self.stats = {"title_length": RunningStat(), "meta_length": RunningStat(), "word_count": RunningStat()}
+        self.keywords: Counter = Counter()
+        self.top: List[str] = []
+        self.unchanged = 0
+
+    def add(self, page: dict) -> bool:
+        """Feed one page; returns True once the crawl can stop."""
+        self.pages += 1
+        if page.get("title"):
+            self.stats["title_length"].add(len(page["title"]))
+        if page.get("meta_description"):
+            self.stats["meta_length"].add(len(page["meta_description"]))
+        if page.get("word_count", 0) > 0:
+            self.stats["word_count"].add(page["word_count"])
+
+        text = f"{page.get('title', '')} {page.get('meta_description', '')}".lower()
+        self.keywords.update(w for w in KEYWORD_PATTERN.findall(text) if w not in STOP_WORDS)
+        top = [word for word, _count in self.keywords.most_common(self.top_k)]
+        if set(top) == set(self.top):
+            self.unchanged += 1
+        else:
+            self.unchanged = 0
+        self.top = top
+        return self.converged()
+
+    def _tight(self, stat: RunningStat) -> bool:
+        # Metrics that never appeared (e.g. no meta descriptions) fall back server-side
+        return stat.count == 0 or stat.half_width(self.z) <= self.tolerance * max(abs(stat.mean), 1.0)
+
+    def converged(self) -> bool:
+        return (
+            self.pages >= self.min_pages
+            and self.unchanged >= self.stable_pages
+            and all(self._tight(stat) for stat in self.stats.values())
+        )
+
+    def summary(self) -> dict:
+        return {
+            "pages": self.pages,
+            "converged": self.converged(),
+            "tolerance": self.tolerance,
+            "metrics": {
+                name: {
+                    "samples": stat.count,
+                    "mean": round(stat.mean, 2),
+                    "half_width": round(stat.half_width(self.z), 2) if stat.count > 1 else None,
+                }
+                for name, stat in self.stats.items()
+            },
+            "top_keywords": self.top,
+            "keywords_stable_for": self.unchanged,
+        }
+
+
+def stdin_lines() -> "DeferredQueue":
+    """Pump stdin lines into a DeferredQueue from a daemon thread ("" marks EOF).
+
+    A daemon thread, unlike the reactor thread pool, does not keep the process
+    alive when the spider closes early while the producer keeps stdin open.
+    """
+    from twisted.internet import reactor  # type: ignore
+
+    queue: DeferredQueue = DeferredQueue()
+
+    def pump() -> None:
+        for line in sys.stdin:
+            reactor.callFromThread(queue.put, line)
+        reactor.callFromThread(queue.put, "")
+
+    threading.Thread(target=pump, name="stdin-reader", daemon=True).start()
+    return queue
 
 
 class PageSpider(scrapy.Spider):
@@ -59,19 +241,112 @@ class PageSpider(scrapy.Spider):
         "RETRY_ENABLED": True,
         "RETRY_TIMES": 1,
         "REDIRECT_ENABLED": True,
+        "ROBOTSTXT_OBEY": True,
+        "DOWNLOADER_MIDDLEWARES": {
+            "scrapy.downloadermiddlewares.robotstxt.RobotsTxtMiddleware": None,
+            "tutorial.middlewares.PersistentRobotsTxtMiddleware": 100,
+            "tutorial.middlewares.TutorialDownloaderMiddleware": 543,
+        },
+        # Profiling hooks stay inactive unless PROFILE_ENABLED is set (see --profile)
+        "SPIDER_MIDDLEWARES": {"tutorial.middlewares.TutorialSpiderMiddleware": 543},
+        "EXTENSIONS": {"tutorial.extensions.CrawlProfiler": 500},
     }
 
-    def __init__(self, katana_file: str, output: str, category: str | None = None, limit: int | None = 30, *args, **kwargs):
+    def __init__(
+        self,
+        katana_file: str,
+        output: str,
+        category: str | None = None,
+        limit: int | None = 30,
+        convergence: ConvergenceMonitor | None = None,
+        max_page_bytes: int = MAX_PAGE_BYTES,
+        output_format: str = "json",
+        *args,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.katana_file = katana_file
+        self.output_format = output_format
+        self.convergence = convergence
+        self.max_page_bytes = max_page_bytes
+        self.skipped: List[dict] = []
         self.category = category or "generic"
         self.output = output
         self.limit = limit
         self.pages: List[dict] = []
-        self.start_urls = load_urls_from_jsonl(katana_file, limit=self.limit)
-        if not self.start_urls:
+        self.streaming = katana_file == STDIN_INPUT
+        self.start_urls = [] if self.streaming else load_urls_from_jsonl(katana_file, limit=self.limit)
+        if not self.start_urls and not self.streaming:
             logger.warning("No URLs provided to spider. Katana JSONL might be empty.")
 
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(spider.bytes_received, signal=signals.bytes_received)
+        return spider
+
+    def page_request(self, url: str, priority: int, **kwargs) -> scrapy.Request:
+        # Only page requests are filtered; robots.txt and other internal requests pass through
+        return scrapy.Request(url, priority=priority, errback=self.download_failed, meta={"page_filter": True}, **kwargs)
+
+    def headers_received(self, headers, body_length, request, spider):
+        """Cancel the transfer as soon as headers show a non-HTML or oversized body."""
+        if not request.meta.get("page_filter"):
+            return
+        # Retries and redirects copy meta; count each attempt's body from zero
+        request.meta["received_bytes"] = 0
+        content_type = headers.get(b"Content-Type", b"").decode("latin-1").split(";")[0].strip().lower()
+        if content_type and content_type not in HTML_CONTENT_TYPES:
+            request.meta["skip"] = {"reason": "content_type", "content_type": content_type}
+            raise StopDownload(fail=True)
+        if self.max_page_bytes and body_length > self.max_page_bytes:
+            request.meta["skip"] = {"reason": "too_large", "bytes": body_length}
+            raise StopDownload(fail=True)
+
+    def bytes_received(self, data, request, spider):
+        """Enforce the byte budget when the server sent no (or a wrong) Content-Length."""
+        if not request.meta.get("page_filter") or not self.max_page_bytes:
+            return
+        received = request.meta.get("received_bytes", 0) + len(data)
+        request.meta["received_bytes"] = received
+        if received > self.max_page_bytes:
+            request.meta["skip"] = {"reason": "too_large", "bytes": received}
+            raise StopDownload(fail=True)
+
+    def download_failed(self, failure):
+        request = failure.request
+        skip = request.meta.get("skip")
+        if failure.check(StopDownload) and skip:
+            self.crawler.stats.inc_value(f"page_filter/skipped/{skip['reason']}")
+            self.skipped.append({"url": request.url, **skip})
+            return
+        logger.warning("Failed to fetch %s: %s", request.url, failure.value)
+
+    async def start(self):
+        if not self.streaming:
+            for url, priority in schedule_urls(self.start_urls):
+                yield self.page_request(url, priority, dont_filter=True)
+            return
+
+        # Read stdin off the reactor so requests are crawled as Katana discovers them
+        seen = set()
+        per_host: Counter = Counter()
+        lines = stdin_lines()
+        while not self.limit or len(seen) < self.limit:
+            line = await maybe_deferred_to_future(lines.get())
+            if not line:
+                break
+            url = url_from_record(line)
+            if url and url not in seen:
+                seen.add(url)
+                tier, depth = url_rank(url)
+                host = (urlparse(url).hostname or "").lower()
+                priority = request_priority(tier, per_host[host], depth)
+                per_host[host] += 1
+                yield self.page_request(url, priority)
+        logger.info("Input stream finished after %s URLs", len(seen))
+
     def parse(self, response: scrapy.http.Response, **kwargs):  # type: ignore[override]
         body_text = " ".join(
             text.strip()
@@ -96,50 +371,340 @@ class PageSpider(scrapy.Spider):
         self.pages.append(page_data)
         yield page_data
 
+        if self.convergence and self.convergence.add(page_data):
+            raise CloseSpider("converged")
+
     def close(self, reason):  # type: ignore[override]
         logger.info("Spider finished: %s (%s pages)", reason, len(self.pages))
-        os.makedirs(os.path.dirname(self.output) or ".", exist_ok=True)
         payload = {
             "category": self.category,
             "generated_at": datetime.now().isoformat(),
+            "stop_reason": reason,
             "pages": self.pages,
+            "skipped": self.skipped,
         }
-        with open(self.output, "w", encoding="utf-8") as handle:
-            json.dump(payload, handle, ensure_ascii=False, indent=2)
+        if self.convergence:
+            payload["convergence"] = self.convergence.summary()
+        payload["keyword_counts"] = page_keyword_counts(self.pages)
+        write_output(self.output, payload, self.output_format)
+
+
+def page_keyword_counts(pages: List[dict]) -> dict:
+    """Keyword frequencies over titles and meta descriptions, so the API server skips tokenising."""
+    texts = [page.get("title") or "" for page in pages] + [page.get("meta_description") or "" for page in pages]
+    return dict(keyword_counts(texts))
+
+
+def profile_settings(output: str, sample_interval: float = 0.0) -> dict:
+    """Scrapy settings enabling the tutorial project's profiling hooks."""
+    from tutorial.extensions import profile_output_path
+
+    return {
+        "PROFILE_ENABLED": True,
+        "PROFILE_OUTPUT": profile_output_path(output),
+        "PROFILE_SAMPLE_INTERVAL": sample_interval,
+    }
+
+
+def load_warmup_hosts(path: str) -> List[str]:
+    """Hostnames from a seed list (URLs or bare hosts, one per line)."""
+    hosts: List[str] = []
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                host = urlparse(line if "://" in line else f"//{line}").hostname
+                if host and host not in hosts:
+                    hosts.append(host)
+    except OSError as exc:
+        logger.warning("Could not read warm-up hosts from %s: %s", path, exc)
+    return hosts
+
+
+def dns_settings(warmup_hosts: List[str], cache_file: str = DNS_CACHE_FILE) -> dict:
+    """Process-level settings for the persistent DNS cache.
+
+    The resolver is installed by CrawlerProcess before any spider exists, so
+    these cannot live in PageSpider.custom_settings.
+    """
+    return {
+        "TWISTED_DNS_RESOLVER": "tutorial.resolver.PersistentCachingResolver",
+        "DNS_PERSIST_FILE": cache_file,
+        "DNS_WARMUP_HOSTS": warmup_hosts,
+    }
 
 
-def run_spider(katana_file: str, output: str, category: str | None, limit: int | None):
-    process = CrawlerProcess()
+def run_spider(
+    katana_file: str,
+    output: str,
+    category: str | None,
+    limit: int | None,
+    profile: bool = False,
+    sample_interval: float = 0.0,
+    warmup_hosts: List[str] | None = None,
+    convergence: ConvergenceMonitor | None = None,
+    max_page_bytes: int = MAX_PAGE_BYTES,
+    output_format: str = "json",
+    robots_cache_dir: str = ROBOTS_CACHE_DIR,
+    dns_cache_file: str = DNS_CACHE_FILE,
+):
+    settings = dns_settings(warmup_hosts or [], dns_cache_file)
+    settings["ROBOTSTXT_CACHE_DIR"] = robots_cache_dir
+    if profile:
+        settings.update(profile_settings(output, sample_interval))
+    process = CrawlerProcess(settings)
     finished = {"status": False}
 
     def mark_finished(*_args, **_kwargs):
         finished["status"] = True
 
-    process.signals.connect(mark_finished, signal=signals.spider_closed)
-    process.crawl(PageSpider, katana_file=katana_file, output=output, category=category, limit=limit)
+    crawler = process.create_crawler(PageSpider)
+    crawler.signals.connect(mark_finished, signal=signals.spider_closed)
+    process.crawl(
+        crawler,
+        katana_file=katana_file,
+        output=output,
+        category=category,
+        limit=limit,
+        convergence=convergence,
+        max_page_bytes=max_page_bytes,
+        output_format=output_format,
+    )
     process.start()
 
     if not finished["status"]:
         raise RuntimeError("Spider did not complete properly")
 
 
+def shard_for(url: str, shards: int) -> int:
+    """Stable shard index by host, so each host's politeness stays in one worker."""
+    host = (urlparse(url).hostname or "").lower()
+    return int.from_bytes(hashlib.sha1(host.encode()).digest()[:4], "big") % shards
+
+
+def run_sharded(args) -> None:
+    """Partition input URLs by host across worker processes and merge their output."""
+    # A SIGTERM sent to the process group also reaches the workers, which stop
+    # gracefully and write partial output; stay alive to merge it.
+    signal.signal(signal.SIGTERM, lambda *_args: logger.warning("SIGTERM received, merging partial shard output"))
+    worker_outputs = [f"{args.output}.shard{index}" for index in range(args.shards)]
+    workers = []
+    for worker_output in worker_outputs:
+        cmd = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--input", STDIN_INPUT,
+            "--output", worker_output,
+            "--category", args.category,
+            "--limit", "0",
+            "--max-page-bytes", str(args.max_page_bytes),
+            "--robots-cache-dir", args.robots_cache_dir,
+            "--dns-cache-file", args.dns_cache_file,
+        ]
+        if args.profile:
+            cmd += ["--profile", "--profile-sample-interval", str(args.profile_sample_interval)]
+        if args.warmup_hosts:
+            cmd += ["--warmup-hosts", args.warmup_hosts]
+        if args.converge:
+            cmd += [
+                "--converge",
+                "--converge-min-pages", str(args.converge_min_pages),
+                "--converge-tolerance", str(args.converge_tolerance),
+            ]
+        workers.append(subprocess.Popen(cmd, stdin=subprocess.PIPE, text=True))
+
+    streaming = args.katana_file == STDIN_INPUT
+    if streaming:
+        source = (url_from_record(line) for line in sys.stdin)
+    else:
+        source = iter(load_urls_from_jsonl(args.katana_file, limit=args.limit))
+    seen = set()
+    try:
+        for url in source:
+            if not url or url in seen:
+                continue
+            seen.add(url)
+            worker = workers[shard_for(url, args.shards)]
+            try:
+                worker.stdin.write(json.dumps({"url": url}) + "\n")
+                worker.stdin.flush()
+            except BrokenPipeError:
+                logger.warning("Shard worker %s exited early, dropping %s", worker.pid, url)
+            if args.limit and len(seen) >= args.limit:
+                break
+    finally:
+        for worker in workers:
+            try:
+                worker.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    pages: List[dict] = []
+    skipped: List[dict] = []
+    profiles = []
+    stop_reasons = []
+    keywords: Counter = Counter()
+    for worker, worker_output in zip(workers, worker_outputs):
+        if worker.wait() != 0:
+            logger.warning("Shard worker %s exited with %s", worker.pid, worker.returncode)
+        if os.path.exists(worker_output):
+            with open(worker_output, "r", encoding="utf-8") as handle:
+                shard_payload = json.load(handle)
+            pages.extend(shard_payload.get("pages", []))
+            skipped.extend(shard_payload.get("skipped", []))
+            stop_reasons.append(shard_payload.get("stop_reason"))
+            keywords.update(shard_payload.get("keyword_counts", {}))
+            os.remove(worker_output)
+        if args.profile:
+            from tutorial.extensions import profile_output_path
+
+            worker_profile = profile_output_path(worker_output)
+            if os.path.exists(worker_profile):
+                with open(worker_profile, "r", encoding="utf-8") as handle:
+                    profiles.append(json.load(handle))
+                os.remove(worker_profile)
+
+    logger.info("Merged %s pages from %s shards (%s URLs)", len(pages), args.shards, len(seen))
+    payload = {
+        "category": args.category,
+        "generated_at": datetime.now().isoformat(),
+        "shards": args.shards,
+        "stop_reasons": stop_reasons,
+        "pages": pages,
+        "skipped": skipped,
+        "keyword_counts": dict(keywords),
+    }
+    write_output(args.output, payload, args.output_format)
+    if args.profile:
+        from tutorial.extensions import profile_output_path
+
+        write_output(profile_output_path(args.output), {"shards": profiles})
+
+
 def main():
     parser = argparse.ArgumentParser(description="Run Scrapy spider over Katana JSONL data")
-    parser.add_argument("--input", dest="katana_file", required=True, help="Path to Katana JSONL file")
+    parser.add_argument(
+        "--input",
+        dest="katana_file",
+        required=True,
+        help="Path to Katana JSONL file, or - to stream JSONL lines from stdin",
+    )
     parser.add_argument("--output", dest="output", required=True, help="Path to write SEO JSON output")
     parser.add_argument("--category", dest="category", default="generic", help="Category name for metadata")
     parser.add_argument("--limit", dest="limit", type=int, default=30, help="Maximum number of URLs to crawl")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Record download latency and callback CPU time, written next to the output as *_profile.json",
+    )
+    parser.add_argument(
+        "--profile-sample-interval",
+        dest="profile_sample_interval",
+        type=float,
+        default=0.0,
+        help="Seconds between stack samples of the statistical profiler (0 disables sampling)",
+    )
+    parser.add_argument(
+        "--shards",
+        dest="shards",
+        type=int,
+        default=1,
+        help="Number of worker processes; URLs are partitioned by host and results merged",
+    )
+    parser.add_argument(
+        "--warmup-hosts",
+        dest="warmup_hosts",
+        default=None,
+        help="Seed list (URLs or hosts, one per line) to resolve before the first requests are scheduled",
+    )
+
+    parser.add_argument(
+        "--converge",
+        action="store_true",
+        help=(
+            "Stop early once title/meta/word-count means and the top keywords have stabilised; "
+            "the estimate assumes URLs arrive in random order, so leave it off for host-ordered input"
+        ),
+    )
+    parser.add_argument(
+        "--converge-min-pages",
+        dest="converge_min_pages",
+        type=int,
+        default=8,
+        help="Minimum pages to crawl before convergence is checked",
+    )
+    parser.add_argument(
+        "--converge-tolerance",
+        dest="converge_tolerance",
+        type=float,
+        default=0.1,
+        help="Maximum 95%% confidence half-width, relative to each mean",
+    )
+
+    parser.add_argument(
+        "--max-page-bytes",
+        dest="max_page_bytes",
+        type=int,
+        default=MAX_PAGE_BYTES,
+        help="Abort downloads larger than this many bytes (0 disables); non-HTML responses are always aborted",
+    )
+
+    parser.add_argument(
+        "--format",
+        dest="output_format",
+        choices=("json", "bin"),
+        default="json",
+        help="Output encoding: JSON, or compact page records read lazily by tutorial.records",
+    )
+
+    parser.add_argument(
+        "--robots-cache-dir",
+        dest="robots_cache_dir",
+        default=ROBOTS_CACHE_DIR,
+        help="Directory of the persistent robots.txt cache shared between runs",
+    )
+    parser.add_argument(
+        "--dns-cache-file",
+        dest="dns_cache_file",
+        default=DNS_CACHE_FILE,
+        help="JSON file of the persistent DNS cache shared between runs",
+    )
 
     args = parser.parse_args()
-    urls = load_urls_from_jsonl(args.katana_file, limit=args.limit)
-    if not urls:
+    if args.shards > 1:
+        run_sharded(args)
+        return
+
+    streaming = args.katana_file == STDIN_INPUT
+    urls = [] if streaming else load_urls_from_jsonl(args.katana_file, limit=args.limit)
+    if not urls and not streaming:
         logger.warning("No URLs found in Katana file, creating empty output")
         payload = {"category": args.category, "generated_at": datetime.now().isoformat(), "pages": []}
-        with open(args.output, "w", encoding="utf-8") as handle:
-            json.dump(payload, handle, ensure_ascii=False, indent=2)
+        write_output(args.output, payload, args.output_format)
         return
 
-    run_spider(args.katana_file, args.output, args.category, args.limit)
+    warmup_hosts = load_warmup_hosts(args.warmup_hosts) if args.warmup_hosts else []
+    for url in urls:
+        host = urlparse(url).hostname
+        if host and host not in warmup_hosts:
+            warmup_hosts.append(host)
+
+    run_spider(
+        args.katana_file,
+        args.output,
+        args.category,
+        args.limit,
+        profile=args.profile,
+        sample_interval=args.profile_sample_interval,
+        warmup_hosts=warmup_hosts,
+        convergence=ConvergenceMonitor(args.converge_min_pages, args.converge_tolerance) if args.converge else None,
+        max_page_bytes=args.max_page_bytes,
+        output_format=args.output_format,
+        robots_cache_dir=args.robots_cache_dir,
+        dns_cache_file=args.dns_cache_file,
+    )
 
 
 if __name__ == "__main__":
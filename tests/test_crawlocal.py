@@ -0,0 +1,50 @@
+"""process_page: parse do spider "page" executado nos pools de PARSE_POOL."""
+
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+pytest.importorskip("scrapy")
+pytest.importorskip("bs4")
+
+from tutorial.spiders.crawlocal import process_page  # noqa: E402
+
+
+def page_body(elements):
+    # Algumas centenas de elementos aninhados: o NavigableString do título não
+    # era serializável com essa profundidade
+    items = "".join(f"<div><span>item {i}</span><img src='/img/{i}.png'>" for i in range(elements))
+    closing = "</div>" * elements
+    return (
+        "<html><head><title> Barbearia Centro </title></head>"
+        f"<body>{items}{closing}</body></html>"
+    ).encode("utf-8")
+
+
+def test_process_page_result_is_plain_data(tmp_path):
+    result = process_page("https://a.com.br/contato", page_body(10), "utf-8", str(tmp_path))
+
+    assert type(result["title"]) is str
+    assert result["title"] == "Barbearia Centro"
+    assert len(pickle.dumps(result)) < 4096
+
+
+def test_process_page_runs_in_process_pool(tmp_path):
+    body = page_body(600)
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        result = pool.submit(process_page, "https://a.com.br/contato", body, "utf-8", str(tmp_path)).result()
+
+    assert result["title"] == "Barbearia Centro"
+    assert "https://a.com.br/img/599.png" in result["image_urls"]
+    assert open(result["filename"], "rb").read() == body
+
+
+def test_pages_with_same_last_segment_get_separate_files(tmp_path):
+    first = process_page("https://a.com.br/contato", b"<html>a</html>", "utf-8", str(tmp_path))
+    second = process_page("https://b.com.br/contato", b"<html>b</html>", "utf-8", str(tmp_path))
+
+    assert first["filename"] != second["filename"]
+    assert open(first["filename"], "rb").read() == b"<html>a</html>"
+    assert open(second["filename"], "rb").read() == b"<html>b</html>"
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,119 @@
+"""ItemMemoryGuard: pausa por memória em voo e pico de RSS num crawl real.
+
+O crawl do spider "page" (tutorial/spiders/crawlocal.py) roda num
+subprocesso contra um servidor HTTP local, para que o ru_maxrss medido seja
+só o do crawl.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("scrapy")
+pytest.importorskip("bs4")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CRAWL_SCRIPT = """
+import json, sys
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+settings = get_project_settings()
+settings.setdict(json.loads(sys.argv[2]), priority="cmdline")
+process = CrawlerProcess(settings)
+crawler = process.create_crawler("page")
+process.crawl(crawler, katana_file=sys.argv[1])
+process.start()
+with open(sys.argv[3], "w") as handle:
+    json.dump(crawler.stats.get_stats(), handle, default=str)
+"""
+
+
+def page_body(index, size):
+    filler = ("conteúdo de teste da página " * (size // 28 + 1))[:size]
+    return (
+        f"<html><head><title>Página {index}</title></head>"
+        f"<body><h1>Página {index}</h1><p>{filler}</p></body></html>"
+    ).encode("utf-8")
+
+
+@pytest.fixture
+def fixture_site():
+    """Servidor local: /page-N.html com corpo de ?size bytes"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path, _, query = self.path.partition("?")
+            size = int(query.split("=", 1)[1]) if query.startswith("size=") else 1024
+            body = page_body(path, size)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def run_crawl(tmp_path, base_url, pages, size, **settings):
+    katana_file = tmp_path / "fixture.jsonl"
+    with open(katana_file, "w") as handle:
+        for index in range(pages):
+            handle.write(json.dumps({"url": f"{base_url}/page-{index}.html?size={size}"}) + "\n")
+    overrides = {
+        "ROBOTSTXT_OBEY": False,
+        "DOWNLOAD_DELAY": 0,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 16,
+        "DNS_PERSIST_FILE": str(tmp_path / "dnscache.json"),
+        "LOG_LEVEL": "WARNING",
+    }
+    overrides.update(settings)
+    stats_file = tmp_path / "stats.json"
+    env = dict(os.environ, SCRAPY_SETTINGS_MODULE="tutorial.settings")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_DIR, env.get("PYTHONPATH")]))
+    subprocess.run(
+        [sys.executable, "-c", CRAWL_SCRIPT, str(katana_file), json.dumps(overrides), str(stats_file)],
+        cwd=tmp_path,
+        env=env,
+        check=True,
+        timeout=120,
+    )
+    with open(stats_file) as handle:
+        return json.load(handle)
+
+
+def test_guard_counts_response_bodies_and_pauses(tmp_path, fixture_site):
+    size = 512 * 1024
+    stats = run_crawl(tmp_path, fixture_site, pages=12, size=size, ITEM_MEMORY_LIMIT=size)
+
+    assert stats["item_scraped_count"] == 12
+    # Os corpos das respostas entram na conta, não só os campos do item
+    assert stats["item_memory/peak_bytes"] >= size
+    assert stats.get("pause/item_memory", 0) >= 1
+
+
+def test_peak_rss_does_not_scale_with_crawl_size(tmp_path, fixture_site):
+    # Um só worker de parse: o custo do BeautifulSoup fica constante entre os crawls
+    page = 1024 * 1024
+    short = run_crawl(tmp_path, fixture_site, pages=30, size=page, PARSE_POOL_SIZE=1)
+    long = run_crawl(tmp_path, fixture_site, pages=120, size=page, PARSE_POOL_SIZE=1)
+
+    assert long["item_scraped_count"] == 120
+    assert long["item_memory/peak_bytes"] < 32 * 1024 * 1024
+    # 90 páginas a mais somam 90 MiB; reter corpos (no item ou em respostas) cresceria tudo isso
+    growth = long["item_memory/max_rss_bytes"] - short["item_memory/max_rss_bytes"]
+    assert growth < 60 * 1024 * 1024, f"peak RSS grew by {growth // 2**20} MiB"
@@ -0,0 +1,222 @@
+# Define here the extensions for your crawls
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from tutorial.stats import percentile
+
+
+def _summarize(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "total": round(sum(values), 4),
+        "mean": round(sum(values) / len(values), 4),
+        "p50": round(percentile(values, 0.5), 4),
+        "p90": round(percentile(values, 0.9), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def pause_crawl(crawler, reason):
+    """Pausar o agendamento de requests; cada motivo precisa ser liberado"""
+    reasons = crawler.__dict__.setdefault("_pause_reasons", set())
+    if not reasons and crawler.engine is not None:
+        crawler.engine.pause()
+        crawler.stats.inc_value(f"pause/{reason}")
+    reasons.add(reason)
+
+
+def resume_crawl(crawler, reason):
+    """Liberar um motivo de pausa; o crawl só volta quando não restar nenhum"""
+    reasons = crawler.__dict__.setdefault("_pause_reasons", set())
+    if reason not in reasons:
+        return
+    reasons.discard(reason)
+    if not reasons and crawler.engine is not None:
+        crawler.engine.unpause()
+
+
+def profile_output_path(output):
+    """Caminho do resumo de profiling ao lado do JSON de saída"""
+    root, _ext = os.path.splitext(output)
+    return f"{root}_profile.json"
+
+
+class StackSampler:
+    """Profiler estatístico: amostra periodicamente a pilha da thread do reactor"""
+
+    def __init__(self, interval, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = 0
+        self.self_counts = Counter()
+        self.cumulative_counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.self_counts[self._label(frame)] += 1
+            seen = set()
+            while frame is not None:
+                label = self._label(frame)
+                if label not in seen:
+                    seen.add(label)
+                    self.cumulative_counts[label] += 1
+                frame = frame.f_back
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+    def summary(self, top=25):
+        def rows(counter):
+            return [
+                {"frame": label, "samples": count, "share": round(count / self.samples, 4)}
+                for label, count in counter.most_common(top)
+            ]
+
+        if not self.samples:
+            return {"interval": self.interval, "samples": 0}
+        return {
+            "interval": self.interval,
+            "samples": self.samples,
+            "self": rows(self.self_counts),
+            "cumulative": rows(self.cumulative_counts),
+        }
+
+
+class CrawlProfiler:
+    """Coleta tempos de download, CPU por callback e tempo nos item pipelines.
+
+    Ativado com PROFILE_ENABLED; os middlewares do projeto alimentam os dados
+    e o resumo é gravado em PROFILE_OUTPUT quando o spider fecha.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.output = settings.get("PROFILE_OUTPUT")
+        self.sample_interval = settings.getfloat("PROFILE_SAMPLE_INTERVAL", 0)
+        self.sampler = None
+        self.started = None
+        self.download_latency = []
+        self.download_total = []
+        self.download_by_host = defaultdict(list)
+        self.slowest = []
+        self.callback_cpu = defaultdict(list)
+        self.callback_wall = defaultdict(list)
+        self.pipeline_wall = []
+        self._items_in_flight = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("PROFILE_ENABLED"):
+            raise NotConfigured
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.item_finished, signal=signals.item_scraped)
+        crawler.signals.connect(ext.item_finished, signal=signals.item_dropped)
+        crawler.signals.connect(ext.item_finished, signal=signals.item_error)
+        return ext
+
+    @classmethod
+    def find(cls, crawler):
+        """Retorna a instância ativa do profiler no crawler, se houver"""
+        extensions = getattr(crawler, "extensions", None)
+        for ext in getattr(extensions, "middlewares", ()):
+            if isinstance(ext, cls):
+                return ext
+        return None
+
+    def spider_opened(self, spider):
+        self.started = time.perf_counter()
+        if self.sample_interval > 0:
+            self.sampler = StackSampler(self.sample_interval)
+            self.sampler.start()
+
+    def record_download(self, request, total, latency):
+        host = urlparse(request.url).netloc
+        self.download_total.append(total)
+        self.download_latency.append(latency)
+        self.download_by_host[host].append(latency)
+        self.slowest.append((latency, request.url))
+        if len(self.slowest) > 50:
+            self.slowest = sorted(self.slowest, reverse=True)[:10]
+
+    def record_callback(self, name, cpu, wall):
+        self.callback_cpu[name].append(cpu)
+        self.callback_wall[name].append(wall)
+
+    def item_started(self, item):
+        self._items_in_flight[id(item)] = time.perf_counter()
+
+    def item_finished(self, item, *args, **kwargs):
+        started = self._items_in_flight.pop(id(item), None)
+        if started is not None:
+            self.pipeline_wall.append(time.perf_counter() - started)
+
+    def summary(self, spider, reason):
+        return {
+            "spider": spider.name,
+            "reason": reason,
+            "generated_at": datetime.now().isoformat(),
+            "elapsed_seconds": round(time.perf_counter() - (self.started or time.perf_counter()), 3),
+            "downloads": {
+                "latency": _summarize(self.download_latency),
+                "queued_and_latency": _summarize(self.download_total),
+                "by_host": {host: _summarize(values) for host, values in self.download_by_host.items()},
+                "slowest": [
+                    {"url": url, "latency": round(latency, 4)}
+                    for latency, url in sorted(self.slowest, reverse=True)[:10]
+                ],
+            },
+            "callbacks": {
+                name: {
+                    "cpu": _summarize(self.callback_cpu[name]),
+                    "wall": _summarize(self.callback_wall[name]),
+                }
+                for name in self.callback_cpu
+            },
+            "pipelines": {"wall": _summarize(self.pipeline_wall)},
+            "sampling": self.sampler.summary() if self.sampler else None,
+        }
+
+    def spider_closed(self, spider, reason):
+        if self.sampler:
+            self.sampler.stop()
+        output = self.output
+        if not output:
+            spider_output = getattr(spider, "output", None)
+            output = profile_output_path(spider_output) if spider_output else f"{spider.name}_profile.json"
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w", encoding="utf-8") as handle:
+            json.dump(self.summary(spider, reason), handle, ensure_ascii=False, indent=2)
+        spider.logger.info("Profile summary written to %s", output)
@@ -16,7 +16,11 @@ class PageItem(scrapy.Item):
     # Dados da página
     title = scrapy.Field()
     url = scrapy.Field()
-    content = scrapy.Field()
+    
+    # O corpo fica em disco; o item carrega só a referência e o hash
+    content_path = scrapy.Field()
+    content_hash = scrapy.Field()
+    content_length = scrapy.Field()
     
     # URLs das imagens encontradas
     image_urls = scrapy.Field()
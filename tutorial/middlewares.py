@@ -3,40 +3,97 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import hashlib
+import logging
+import os
+import pickle
+import resource
+import time
+
 from scrapy import signals
+from scrapy.downloadermiddlewares.robotstxt import RobotsTxtMiddleware
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.misc import build_from_crawler
 
 # useful for handling different item types with a single interface
-from itemadapter import ItemAdapter
+from itemadapter import ItemAdapter, is_item
+
+from tutorial.extensions import CrawlProfiler, pause_crawl, resume_crawl
+
+logger = logging.getLogger(__name__)
+
+
+def _callback_name(response, spider):
+    callback = getattr(response.request, "callback", None) if response.request else None
+    return getattr(callback, "__name__", None) or "parse"
 
 
 class TutorialSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    # Hook de profiling: mede o tempo de CPU (thread do reactor) e o tempo
+    # de parede de cada callback, e marca o início dos itens nos pipelines.
+    # Só é ativado quando PROFILE_ENABLED = True.
+
+    def __init__(self, profiler):
+        self.profiler = profiler
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        profiler = CrawlProfiler.find(crawler)
+        if profiler is None:
+            raise NotConfigured
+        s = cls(profiler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
-    def process_spider_input(self, response, spider):
+    def process_spider_input(self, response, spider=None):
         # Called for each response that goes through the spider
         # middleware and into the spider.
 
         # Should return None or raise an exception.
         return None
 
-    def process_spider_output(self, response, result, spider):
+    def process_spider_output(self, response, result, spider=None):
         # Called with the results returned from the Spider, after
         # it has processed the response.
 
         # Must return an iterable of Request, or item objects.
-        for i in result:
+        name = _callback_name(response, spider)
+        iterator = iter(result)
+        cpu = wall = 0.0
+        while True:
+            cpu_start, wall_start = time.thread_time(), time.perf_counter()
+            try:
+                i = next(iterator)
+            except StopIteration:
+                self.profiler.record_callback(name, cpu + time.thread_time() - cpu_start, wall + time.perf_counter() - wall_start)
+                return
+            cpu += time.thread_time() - cpu_start
+            wall += time.perf_counter() - wall_start
+            if is_item(i):
+                self.profiler.item_started(i)
             yield i
 
-    def process_spider_exception(self, response, exception, spider):
+    async def process_spider_output_async(self, response, result, spider=None):
+        # Versão para callbacks assíncronos: o tempo de parede inclui as esperas
+        name = _callback_name(response, spider)
+        iterator = result.__aiter__()
+        cpu = wall = 0.0
+        while True:
+            cpu_start, wall_start = time.thread_time(), time.perf_counter()
+            try:
+                i = await iterator.__anext__()
+            except StopAsyncIteration:
+                self.profiler.record_callback(name, cpu + time.thread_time() - cpu_start, wall + time.perf_counter() - wall_start)
+                return
+            cpu += time.thread_time() - cpu_start
+            wall += time.perf_counter() - wall_start
+            if is_item(i):
+                self.profiler.item_started(i)
+            yield i
+
+    def process_spider_exception(self, response, exception, spider=None):
         # Called when a spider or process_spider_input() method
         # (from other spider middleware) raises an exception.
 
@@ -54,18 +111,24 @@ class TutorialSpiderMiddleware:
 
 
 class TutorialDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    # Hook de profiling: registra a latência de cada download (download_latency
+    # do Scrapy) e o tempo total desde a entrada no downloader, incluindo a
+    # espera no slot. Só é ativado quando PROFILE_ENABLED = True.
+
+    def __init__(self, profiler):
+        self.profiler = profiler
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        profiler = CrawlProfiler.find(crawler)
+        if profiler is None:
+            raise NotConfigured
+        s = cls(profiler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
-    def process_request(self, request, spider):
+    def process_request(self, request, spider=None):
         # Called for each request that goes through the downloader
         # middleware.
 
@@ -75,18 +138,23 @@ class TutorialDownloaderMiddleware:
         # - or return a Request object
         # - or raise IgnoreRequest: process_exception() methods of
         #   installed downloader middleware will be called
+        request.meta["profile_start"] = time.perf_counter()
         return None
 
-    def process_response(self, request, response, spider):
+    def process_response(self, request, response, spider=None):
         # Called with the response returned from the downloader.
 
         # Must either;
         # - return a Response object
         # - return a Request object
         # - or raise IgnoreRequest
+        started = request.meta.get("profile_start")
+        if started is not None:
+            total = time.perf_counter() - started
+            self.profiler.record_download(request, total, request.meta.get("download_latency", total))
         return response
 
-    def process_exception(self, request, exception, spider):
+    def process_exception(self, request, exception, spider=None):
         # Called when a download handler or a process_request()
         # (from other downloader middleware) raises an exception.
 
@@ -98,3 +166,181 @@ class TutorialDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+def item_size(item):
+    """Estimativa barata do tamanho de um item: bytes dos valores texto/listas"""
+    size = 0
+    for value in ItemAdapter(item).values():
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        elif isinstance(value, (list, tuple, set)):
+            size += sum(len(v) for v in value if isinstance(v, (str, bytes)))
+    return size
+
+
+class ItemMemoryGuard:
+    # Limita a memória de conteúdo em voo: o corpo das respostas enquanto o
+    # callback ainda as processa (ex.: esperando o pool de parse) e os itens
+    # ainda nos pipelines. Acima de ITEM_MEMORY_LIMIT bytes o agendamento de
+    # novas requests é pausado até esse conteúdo ser liberado.
+    # Registra o pico em item_memory/peak_bytes e o RSS máximo do processo.
+
+    def __init__(self, crawler, limit):
+        self.crawler = crawler
+        self.limit = limit
+        self.in_flight = {}
+        self.bytes = 0
+        self.peak = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        limit = crawler.settings.getint("ITEM_MEMORY_LIMIT", 0)
+        if limit <= 0:
+            raise NotConfigured
+        s = cls(crawler, limit)
+        crawler.signals.connect(s.item_finished, signal=signals.item_scraped)
+        crawler.signals.connect(s.item_finished, signal=signals.item_dropped)
+        crawler.signals.connect(s.item_finished, signal=signals.item_error)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def _acquire(self, key, size):
+        self.in_flight[key] = size
+        self.bytes += size
+        if self.bytes > self.peak:
+            self.peak = self.bytes
+            self.crawler.stats.max_value("item_memory/peak_bytes", self.peak)
+        if self.bytes > self.limit:
+            pause_crawl(self.crawler, "item_memory")
+
+    def _release(self, key):
+        self.bytes -= self.in_flight.pop(key, 0)
+        if self.bytes <= self.limit:
+            resume_crawl(self.crawler, "item_memory")
+
+    def _track(self, i):
+        if is_item(i):
+            self._acquire(id(i), item_size(i))
+        return i
+
+    def process_spider_input(self, response, spider=None):
+        # O corpo fica vivo até o callback terminar de produzir resultados
+        self._acquire(("response", id(response)), len(response.body))
+        return None
+
+    def process_spider_output(self, response, result, spider=None):
+        try:
+            for i in result:
+                yield self._track(i)
+        finally:
+            self._release(("response", id(response)))
+
+    async def process_spider_output_async(self, response, result, spider=None):
+        try:
+            async for i in result:
+                yield self._track(i)
+        finally:
+            self._release(("response", id(response)))
+
+    def process_spider_exception(self, response, exception, spider=None):
+        self._release(("response", id(response)))
+
+    def item_finished(self, item, *args, **kwargs):
+        self._release(id(item))
+
+    def spider_closed(self, spider):
+        # ru_maxrss é em KiB no Linux
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.crawler.stats.set_value("item_memory/max_rss_bytes", max_rss)
+
+
+class RobotsTxtCache:
+    """Cache em disco de robots.txt com TTL, compartilhado entre execuções
+
+    Guarda o corpo original e o estado do parser já construído (sem a
+    referência ao spider), para que crawls seguintes não precisem baixar
+    nem re-interpretar o arquivo.
+    """
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, netloc):
+        return os.path.join(self.directory, hashlib.sha1(netloc.encode()).hexdigest() + ".pickle")
+
+    def load(self, netloc):
+        """Retorna (corpo, estado do parser) se ainda válido, senão None"""
+        try:
+            with open(self._path(netloc), "rb") as handle:
+                entry = pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        if entry.get("netloc") != netloc or time.time() - entry["fetched_at"] > self.ttl:
+            return None
+        return entry
+
+    def store(self, netloc, body, parser):
+        state = None
+        if parser is not None:
+            # A referência ao spider é recolocada ao restaurar
+            state = {key: value for key, value in vars(parser).items() if key != "spider"}
+        entry = {"netloc": netloc, "fetched_at": time.time(), "body": body, "parser": type(parser), "state": state}
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(netloc)}.{os.getpid()}.tmp"
+        try:
+            try:
+                with open(tmp_path, "wb") as handle:
+                    pickle.dump(entry, handle)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                # Parser sem estado serializável: guardar apenas o corpo
+                entry.update(parser=None, state=None)
+                with open(tmp_path, "wb") as handle:
+                    pickle.dump(entry, handle)
+            os.replace(tmp_path, self._path(netloc))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class PersistentRobotsTxtMiddleware(RobotsTxtMiddleware):
+    # RobotsTxtMiddleware com cache persistente (ROBOTSTXT_CACHE_DIR): hosts
+    # vistos há menos de ROBOTSTXT_CACHE_TTL segundos não geram nova
+    # requisição de robots.txt antes da primeira página.
+
+    def __init__(self, crawler):
+        super().__init__(crawler)
+        settings = crawler.settings
+        self.cache = RobotsTxtCache(
+            settings.get("ROBOTSTXT_CACHE_DIR", "data/robotstxt"),
+            settings.getfloat("ROBOTSTXT_CACHE_TTL", 86400),
+        )
+
+    async def robot_parser(self, request, *args):
+        netloc = urlparse_cached(request).netloc
+        if netloc not in self._parsers:
+            entry = self.cache.load(netloc)
+            if entry is not None:
+                self._parsers[netloc] = self._restore_parser(entry)
+                self._stats.inc_value("robotstxt/cache_hit")
+        return await super().robot_parser(request, *args)
+
+    def _restore_parser(self, entry):
+        parser_cls, state = entry.get("parser"), entry.get("state")
+        if state is not None and parser_cls is self._parserimpl:
+            parser = parser_cls.__new__(parser_cls)
+            vars(parser).update(state, spider=self.crawler.spider)
+            return parser
+        # Parser diferente do configurado ou sem estado: re-interpretar o corpo
+        return build_from_crawler(self._parserimpl, self.crawler, entry["body"])
+
+    async def _parse_robots(self, response, netloc, *args):
+        await super()._parse_robots(response, netloc, *args)
+        # Falha ao gravar o cache (disco cheio, sem permissão) não pode derrubar o crawl
+        try:
+            self.cache.store(netloc, response.body, self._parsers.get(netloc))
+        except OSError as exc:
+            logger.warning("Could not cache robots.txt for %s: %s", netloc, exc)
+            self._stats.inc_value("robotstxt/cache_store_error")
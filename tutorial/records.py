@@ -0,0 +1,165 @@
+# Formato binário dos registros de páginas (alternativa ao {category}_seo.json)
+#
+# Layout:
+#   MAGIC | u32 tamanho do cabeçalho | cabeçalho JSON (tudo menos "pages")
+#   registros: struct RECORD (status, h1_count, word_count e tamanhos)
+#              + url, title, meta_description (UTF-8) + campos pesados (JSON)
+#
+# Os campos usados pelos insights são decodificados na leitura, também em
+# colunas (payload["columns"]); os pesados (h1_samples, headers, ...) ficam
+# como bytes até serem acessados.
+
+import json
+import os
+import struct
+from collections.abc import Mapping
+
+MAGIC = b"SEOREC\x00\x01"
+HEADER = struct.Struct("<I")
+RECORD = struct.Struct("<HHIIIII")
+HOT_FIELDS = ("url", "status", "title", "meta_description", "h1_count", "word_count")
+# Colunas que os insights consomem, na ordem das páginas
+COLUMNS = ("url", "title", "meta_description", "h1_count", "word_count")
+
+
+def _clamp(value, limit):
+    return max(0, min(int(value or 0), limit))
+
+
+def encode_page(page):
+    """Serializar uma página: campos quentes fixos + resto em JSON"""
+    url = (page.get("url") or "").encode("utf-8")
+    title = (page.get("title") or "").encode("utf-8")
+    meta = (page.get("meta_description") or "").encode("utf-8")
+    heavy_fields = {key: value for key, value in page.items() if key not in HOT_FIELDS}
+    heavy = json.dumps(heavy_fields, ensure_ascii=False, separators=(",", ":")).encode("utf-8") if heavy_fields else b""
+    head = RECORD.pack(
+        _clamp(page.get("status"), 0xFFFF),
+        _clamp(page.get("h1_count"), 0xFFFF),
+        _clamp(page.get("word_count"), 0xFFFFFFFF),
+        len(url),
+        len(title),
+        len(meta),
+        len(heavy),
+    )
+    return b"".join((head, url, title, meta, heavy))
+
+
+def write_records(path, payload):
+    """Gravar o payload do scrapy-runner (cabeçalho + "pages") de forma atômica"""
+    header = {key: value for key, value in payload.items() if key not in ("pages", "columns")}
+    header["count"] = len(payload.get("pages", []))
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(MAGIC)
+        handle.write(HEADER.pack(len(header_bytes)))
+        handle.write(header_bytes)
+        for page in payload.get("pages", []):
+            handle.write(encode_page(page))
+    os.replace(tmp_path, path)
+
+
+class PageRecord(Mapping):
+    """Página lida do formato binário; se comporta como o dict original"""
+
+    __slots__ = ("url", "status", "title", "meta_description", "h1_count", "word_count", "_raw", "_heavy")
+
+    def __init__(self, url, status, title, meta_description, h1_count, word_count, raw):
+        self.url = url
+        self.status = status
+        self.title = title
+        self.meta_description = meta_description
+        self.h1_count = h1_count
+        self.word_count = word_count
+        self._raw = raw
+        self._heavy = None
+
+    @property
+    def heavy(self):
+        """Campos pesados, decodificados no primeiro acesso"""
+        if self._heavy is None:
+            self._heavy = json.loads(self._raw) if self._raw else {}
+            self._raw = b""
+        return self._heavy
+
+    def __getitem__(self, key):
+        if key in HOT_FIELDS:
+            return getattr(self, key)
+        return self.heavy[key]
+
+    def __iter__(self):
+        yield from HOT_FIELDS
+        yield from self.heavy
+
+    def __len__(self):
+        return len(HOT_FIELDS) + len(self.heavy)
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+def json_default(value):
+    """``default`` do json.dump: payloads de read_records viram dicts comuns"""
+    if isinstance(value, PageRecord):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def page_columns(pages):
+    """Colunas de COLUMNS a partir de páginas em dict (saída JSON do scrapy-runner)"""
+    return {
+        "url": [page.get("url") or "" for page in pages],
+        "title": [page.get("title") or "" for page in pages],
+        "meta_description": [page.get("meta_description") or "" for page in pages],
+        "h1_count": [page.get("h1_count") or 0 for page in pages],
+        "word_count": [page.get("word_count") or 0 for page in pages],
+    }
+
+
+def is_record_file(path):
+    try:
+        with open(path, "rb") as handle:
+            return handle.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def read_records(path):
+    """Ler o arquivo: retorna o cabeçalho com "pages" como lista de PageRecord"""
+    with open(path, "rb") as handle:
+        data = memoryview(handle.read())
+    if bytes(data[: len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path} is not a page record file")
+    offset = len(MAGIC)
+    (header_length,) = HEADER.unpack_from(data, offset)
+    offset += HEADER.size
+    payload = json.loads(bytes(data[offset : offset + header_length]))
+    offset += header_length
+
+    pages = []
+    urls, titles, metas, h1_counts, word_counts = columns = ([], [], [], [], [])
+    unpack_from = RECORD.unpack_from
+    record_size = RECORD.size
+    end = len(data)
+    while offset < end:
+        status, h1_count, word_count, url_len, title_len, meta_len, heavy_len = unpack_from(data, offset)
+        offset += record_size
+        url = str(data[offset : offset + url_len], "utf-8")
+        offset += url_len
+        title = str(data[offset : offset + title_len], "utf-8")
+        offset += title_len
+        meta = str(data[offset : offset + meta_len], "utf-8")
+        offset += meta_len
+        # Cópia dos bytes pesados: uma fatia do memoryview manteria o arquivo inteiro vivo
+        pages.append(PageRecord(url, status, title, meta, h1_count, word_count, bytes(data[offset : offset + heavy_len])))
+        offset += heavy_len
+        urls.append(url)
+        titles.append(title)
+        metas.append(meta)
+        h1_counts.append(h1_count)
+        word_counts.append(word_count)
+    payload["pages"] = pages
+    payload["columns"] = dict(zip(COLUMNS, columns))
+    return payload
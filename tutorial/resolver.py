@@ -0,0 +1,116 @@
+# Resolver DNS com cache persistente entre execuções do crawl
+#
+# Ative com TWISTED_DNS_RESOLVER = "tutorial.resolver.PersistentCachingResolver".
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/settings.html#dns-resolver
+
+import json
+import logging
+import os
+import time
+
+from scrapy.resolver import CachingThreadedResolver, dnscache
+from twisted.internet.threads import deferToThread
+
+try:
+    import dns.resolver  # type: ignore
+except ImportError:  # dnspython é opcional: sem ele usa-se DNS_PERSIST_TTL
+    dns = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def record_ttl(name):
+    """TTL do registro A consultado via dnspython, se disponível"""
+    if dns is None:
+        return None
+    try:
+        return dns.resolver.resolve(name, "A").rrset.ttl
+    except Exception:
+        return None
+
+
+class PersistentCachingResolver(CachingThreadedResolver):
+    """CachingThreadedResolver que grava as resoluções em DNS_PERSIST_FILE
+
+    Entradas ainda válidas são carregadas no cache do Scrapy ao iniciar, e
+    os hosts de DNS_WARMUP_HOSTS são resolvidos em paralelo logo que o
+    reactor sobe, antes das primeiras requests chegarem ao downloader.
+    """
+
+    def __init__(self, reactor, cache_size, timeout, path, default_ttl, warmup_hosts=()):
+        super().__init__(reactor, cache_size, timeout)
+        self.path = path
+        self.default_ttl = default_ttl
+        self.warmup_hosts = list(warmup_hosts)
+        self.entries = {}
+        self._load()
+
+    @classmethod
+    def from_crawler(cls, crawler, reactor):
+        settings = crawler.settings
+        cache_size = settings.getint("DNSCACHE_SIZE") if settings.getbool("DNSCACHE_ENABLED") else 0
+        return cls(
+            reactor,
+            cache_size,
+            settings.getfloat("DNS_TIMEOUT"),
+            settings.get("DNS_PERSIST_FILE", "data/dnscache.json"),
+            settings.getfloat("DNS_PERSIST_TTL", 3600),
+            settings.getlist("DNS_WARMUP_HOSTS"),
+        )
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as handle:
+                stored = json.load(handle)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for name, entry in stored.items():
+            if entry.get("expires_at", 0) > now:
+                self.entries[name] = entry
+                dnscache[name] = entry["address"]
+        logger.debug("Loaded %s cached DNS entries from %s", len(self.entries), self.path)
+
+    def install_on_reactor(self):
+        super().install_on_reactor()
+        self.reactor.addSystemEventTrigger("before", "shutdown", self.save)
+        self.reactor.callWhenRunning(self.warmup)
+
+    def warmup(self):
+        """Resolver em paralelo (threadpool do reactor) os hosts conhecidos da categoria"""
+        pending = [host for host in self.warmup_hosts if host not in dnscache]
+        for host in pending:
+            self.getHostByName(host).addErrback(lambda failure, host=host: logger.debug(
+                "DNS warm-up failed for %s: %s", host, failure.value
+            ))
+        if pending:
+            logger.info("DNS warm-up started for %s hosts", len(pending))
+
+    def _cache_result(self, result, name):
+        result = super()._cache_result(result, name)
+        self.entries[name] = {"address": result, "expires_at": time.time() + self.default_ttl}
+        if dns is not None:
+            deferToThread(record_ttl, name).addCallback(self._apply_ttl, name)
+        return result
+
+    def _apply_ttl(self, ttl, name):
+        if ttl is not None and name in self.entries:
+            self.entries[name]["expires_at"] = time.time() + ttl
+
+    def save(self):
+        """Mesclar com o arquivo atual (outros processos/shards) e gravar"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as handle:
+                stored = json.load(handle)
+        except (OSError, ValueError):
+            stored = {}
+        now = time.time()
+        stored = {name: entry for name, entry in stored.items() if entry.get("expires_at", 0) > now}
+        stored.update(self.entries)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(stored, handle)
+        os.replace(tmp_path, self.path)
@@ -21,6 +21,11 @@ ADDONS = {}
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = True
 
+# Cache persistente de robots.txt (corpo e parser), compartilhado por todos
+# os spiders e pelo scrapy-runner.py
+ROBOTSTXT_CACHE_DIR = "data/robotstxt"
+ROBOTSTXT_CACHE_TTL = 24 * 3600  # segundos
+
 # Concurrency and throttling settings
 #CONCURRENT_REQUESTS = 16
 CONCURRENT_REQUESTS_PER_DOMAIN = 1
@@ -51,23 +56,43 @@ IMAGES_EXPIRES = 90  # dias
 #    "Accept-Language": "en",
 #}
 
+# Parse das páginas (BeautifulSoup, prettify e escrita dos arquivos) fora do
+# reactor: "thread" ou "process". Com PARSE_POOL_MAX_PENDING parses em
+# andamento o agendamento de novas requests é pausado.
+PARSE_POOL = "thread"
+PARSE_POOL_SIZE = 4
+PARSE_POOL_MAX_PENDING = 8
+
+# Profiling do crawl: latência de download, CPU por callback e tempo nos
+# pipelines. Ative com `-s PROFILE_ENABLED=True`; o resumo é gravado em
+# PROFILE_OUTPUT (padrão: ao lado do arquivo de saída do spider).
+PROFILE_ENABLED = False
+PROFILE_OUTPUT = None
+# Intervalo (segundos) do profiler estatístico; 0 desativa a amostragem
+PROFILE_SAMPLE_INTERVAL = 0
+
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "tutorial.middlewares.TutorialSpiderMiddleware": 543,
-#}
+# Os middlewares do projeto são hooks de profiling e ficam inativos
+# enquanto PROFILE_ENABLED = False
+SPIDER_MIDDLEWARES = {
+    "tutorial.middlewares.TutorialSpiderMiddleware": 543,
+    "tutorial.middlewares.ItemMemoryGuard": 550,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "tutorial.middlewares.TutorialDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    "scrapy.downloadermiddlewares.robotstxt.RobotsTxtMiddleware": None,
+    "tutorial.middlewares.PersistentRobotsTxtMiddleware": 100,
+    "tutorial.middlewares.TutorialDownloaderMiddleware": 543,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "tutorial.extensions.CrawlProfiler": 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -98,3 +123,15 @@ IMAGES_EXPIRES = 90  # dias
 
 # Set settings whose default value is deprecated to a future-proof value
 FEED_EXPORT_ENCODING = "utf-8"
+
+# O parse assíncrono do crawlocal aguarda futures do asyncio
+TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
+
+# Teto de bytes em voo: corpos de respostas em processamento + itens nos pipelines (0 desativa o ItemMemoryGuard)
+ITEM_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# Cache DNS persistido entre execuções (ver tutorial/resolver.py)
+TWISTED_DNS_RESOLVER = "tutorial.resolver.PersistentCachingResolver"
+DNS_PERSIST_FILE = "data/dnscache.json"
+DNS_PERSIST_TTL = 3600  # Usado quando o dnspython não está instalado para ler o TTL real
+DNS_WARMUP_HOSTS = []
@@ -2,11 +2,17 @@ from fileinput import filename
 from pathlib import Path
 from urllib import response
 from bs4 import BeautifulSoup
+import asyncio
+import hashlib
 import json
+import os
 import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse
 
 import scrapy
+from tutorial.extensions import pause_crawl, resume_crawl
 from tutorial.items import PageItem
 
 
@@ -29,8 +35,13 @@ class QuotesSpider(scrapy.Spider):
             else:
                 self.katana_filename = 'default'
 
+    async def start(self):
+        # Scrapy >= 2.13 usa start(); start_requests() segue como implementação
+        for request in self.start_requests():
+            yield request
+
     def start_requests(self):
-        if not self.katana_file:
+        if not getattr(self, 'katana_file', None):
             self.logger.error("Arquivo katana_file é obrigatório!")
             return
 
@@ -94,7 +105,20 @@ class QuotesSpider(scrapy.Spider):
                 
         return True
 
-    def parse(self, response):
+    def _parse_pool(self):
+        """Pool onde o parse pesado (BeautifulSoup, prettify, escrita) é executado"""
+        if getattr(self, '_pool', None) is None:
+            settings = self.crawler.settings
+            size = settings.getint('PARSE_POOL_SIZE', 4)
+            if settings.get('PARSE_POOL', 'thread') == 'process':
+                self._pool = ProcessPoolExecutor(max_workers=size)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix='parse')
+            self._pool_max_pending = settings.getint('PARSE_POOL_MAX_PENDING', size * 2)
+            self._pool_pending = 0
+        return self._pool
+
+    async def parse(self, response):
         # Criar pasta com base no nome do arquivo JSON
         if hasattr(self, 'katana_file') and self.katana_file:
             # Extrair nome do arquivo sem extensão
@@ -117,42 +141,34 @@ class QuotesSpider(scrapy.Spider):
         
         # Limpar nome do arquivo
         page_name = page_name.replace('.', '_') if page_name else 'page'
-        filename = output_folder / f"page-{page_name}.html"
         
-        # Salvar HTML raw
-        filename.write_bytes(response.body)
-        self.log(f"Saved file {filename}")
-
-        # Salvar HTML formatado
-        soup = BeautifulSoup(response.body, "html.parser")
-        pretty_html = soup.prettify()
-        pretty_filename = output_folder / f"pretty-{page_name}.html"
-        pretty_filename.write_text(pretty_html, encoding="utf-8")
-        
-        # Extrair URLs de imagens
-        image_urls = []
+        # Parse e escrita fora do reactor; com o pool cheio o agendamento é
+        # pausado até algum parse terminar, mas os downloads em curso seguem
+        pool = self._parse_pool()
+        self._pool_pending += 1
+        if self._pool_pending >= self._pool_max_pending:
+            pause_crawl(self.crawler, 'parse_pool')
+        try:
+            future = pool.submit(
+                process_page, response.url, response.body, response.encoding, str(output_folder)
+            )
+            result = await asyncio.wrap_future(future)
+        finally:
+            self._pool_pending -= 1
+            if self._pool_pending < self._pool_max_pending:
+                resume_crawl(self.crawler, 'parse_pool')
         
-        # Encontrar todas as tags img
-        for img in soup.find_all('img'):
-            src = img.get('src')
-            if src:
-                # Converter URL relativa para absoluta
-                full_url = urljoin(response.url, src)
-                if self._is_valid_image_url(full_url):
-                    image_urls.append(full_url)
-        
-        # Procurar por imagens em CSS background-image
-        css_images = re.findall(r'background-image:\s*url\(["\']?([^"\'()]+)["\']?\)', response.text)
-        for img_url in css_images:
-            full_url = urljoin(response.url, img_url)
-            if self._is_valid_image_url(full_url):
-                image_urls.append(full_url)
+        self.log(f"Saved file {result['filename']}")
+        image_urls = result['image_urls']
         
         # Criar item com dados da página e imagens
         item = PageItem()
-        item['title'] = soup.title.string if soup.title else page_name
+        # Só str no item: nada que referencie o soup ou o corpo da resposta
+        item['title'] = str(result['title'] or page_name)
         item['url'] = response.url
-        item['content'] = response.text
+        item['content_path'] = result['filename']
+        item['content_hash'] = result['content_hash']
+        item['content_length'] = len(response.body)
         item['image_urls'] = list(set(image_urls)) if image_urls else []  # Remove duplicatas e garante lista
         item['images'] = []  # Inicializar campo para ImagesPipeline
         
@@ -163,23 +179,80 @@ class QuotesSpider(scrapy.Spider):
         # Retornar item para pipeline processar as imagens
         yield item
 
-    def _is_valid_image_url(self, url):
-        """Verificar se é uma URL de imagem válida"""
-        try:
-            parsed = urlparse(url)
-            # Verificar extensões de imagem
-            valid_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg']
-            path = parsed.path.lower()
-            
-            # Verificar se termina com extensão válida
-            for ext in valid_extensions:
-                if path.endswith(ext):
-                    return True
-            
-            # Verificar se contém parâmetros de imagem (ex: Next.js images)
-            if 'image' in parsed.path.lower() or 'img' in parsed.path.lower():
+    def closed(self, reason):
+        if getattr(self, '_pool', None) is not None:
+            self._pool.shutdown(wait=True)
+
+
+def write_atomic(path, data):
+    """Gravar via arquivo temporário: quem lê nunca vê um arquivo pela metade"""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def process_page(url, body, encoding, output_folder):
+    """Salvar HTML, formatar e extrair imagens de uma página (executa no pool)"""
+    output_folder = Path(output_folder)
+    # Nome pelo hash da URL: o último segmento (ex.: /contato) se repete entre sites
+    page_key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    filename = output_folder / f"page-{page_key}.html"
+    
+    # Salvar HTML raw
+    write_atomic(filename, body)
+
+    # Salvar HTML formatado
+    soup = BeautifulSoup(body, "html.parser")
+    pretty_html = soup.prettify()
+    write_atomic(output_folder / f"pretty-{page_key}.html", pretty_html.encode("utf-8"))
+    
+    # Extrair URLs de imagens
+    image_urls = []
+    
+    # Encontrar todas as tags img
+    for img in soup.find_all('img'):
+        src = img.get('src')
+        if src:
+            # Converter URL relativa para absoluta
+            full_url = urljoin(url, src)
+            if is_valid_image_url(full_url):
+                image_urls.append(full_url)
+    
+    # Procurar por imagens em CSS background-image
+    text = body.decode(encoding or 'utf-8', errors='replace')
+    css_images = re.findall(r'background-image:\s*url\(["\']?([^"\'()]+)["\']?\)', text)
+    for img_url in css_images:
+        full_url = urljoin(url, img_url)
+        if is_valid_image_url(full_url):
+            image_urls.append(full_url)
+    
+    return {
+        'filename': str(filename),
+        'content_hash': hashlib.sha256(body).hexdigest(),
+        # str simples: o NavigableString leva a árvore inteira junto (.parent), o que
+        # estoura o pickle de volta do ProcessPoolExecutor e prende o soup na memória
+        'title': (soup.title.get_text(strip=True) or None) if soup.title else None,
+        'image_urls': image_urls,
+    }
+
+
+def is_valid_image_url(url):
+    """Verificar se é uma URL de imagem válida"""
+    try:
+        parsed = urlparse(url)
+        # Verificar extensões de imagem
+        valid_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg']
+        path = parsed.path.lower()
+        
+        # Verificar se termina com extensão válida
+        for ext in valid_extensions:
+            if path.endswith(ext):
                 return True
-                
-            return False
-        except:
-            return False
\ No newline at end of file
+        
+        # Verificar se contém parâmetros de imagem (ex: Next.js images)
+        if 'image' in parsed.path.lower() or 'img' in parsed.path.lower():
+            return True
+            
+        return False
+    except:
+        return False
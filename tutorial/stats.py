@@ -0,0 +1,42 @@
+# Estatísticas simples compartilhadas pelo profiler, pelo scrapy-runner, pelo
+# servidor de insights e pelo gerador de carga (só biblioteca padrão)
+
+import re
+from collections import Counter
+
+# Tokenização das keywords dos insights (título + meta description)
+KEYWORD_PATTERN = re.compile(r"\b[a-záàâãéèêíïóôõöúçñ]{3,}\b")
+STOP_WORDS = {
+    "que", "para", "com", "uma", "seu", "sua", "nos", "das", "dos",
+    "mais", "como", "por", "são", "tem", "ter", "foi", "pelo", "pela",
+}
+
+
+def percentile(values, q):
+    """Percentil com interpolação linear (mesmo método padrão do numpy)
+
+    Aceita qualquer sequência de números; listas já ordenadas custam O(n).
+    Sequência vazia retorna 0.0.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def keyword_counts(texts):
+    """Frequência das keywords de uma sequência de textos, sem stop words
+
+    Os tokens separados por espaço são contados primeiro e o regex roda uma
+    vez por token distinto: nenhum match atravessa espaços, então o
+    resultado é o mesmo de aplicar KEYWORD_PATTERN ao texto inteiro.
+    """
+    counts = Counter()
+    for token, count in Counter(" ".join(texts).lower().split()).items():
+        for word in KEYWORD_PATTERN.findall(token):
+            if word not in STOP_WORDS:
+                counts[word] += count
+    return counts
@@ -0,0 +1,28 @@
+# Classificação de URLs compartilhada pelo servidor de insights (orçamento do
+# katana) e pelo scrapy-runner (prioridade das requisições)
+
+import os
+from urllib.parse import urlparse
+
+# Extensões que não são páginas (o katana emite scripts, estilos e imagens)
+ASSET_EXTENSIONS = {
+    ".js", ".mjs", ".css", ".map", ".json", ".xml", ".txt", ".png", ".jpg", ".jpeg",
+    ".gif", ".svg", ".webp", ".ico", ".woff", ".woff2", ".ttf", ".eot", ".mp4", ".webm",
+}
+PAGE_EXTENSIONS = {"", ".html", ".htm", ".php", ".asp", ".aspx", ".jsp"}
+
+
+def url_rank(url):
+    """(nível, profundidade): 0 = home, 1 = página HTML, 2 = outros, 3 = asset"""
+    parsed = urlparse(url)
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    extension = os.path.splitext(segments[-1])[1].lower() if segments else ""
+    if extension in ASSET_EXTENSIONS:
+        tier = 3
+    elif extension not in PAGE_EXTENSIONS:
+        tier = 2
+    elif not segments and not parsed.query:
+        tier = 0
+    else:
+        tier = 1
+    return tier, len(segments) + (1 if parsed.query else 0)